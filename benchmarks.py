@@ -0,0 +1,356 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import threading
+import functools
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+import matplotlib
+matplotlib.use("Agg")
+import numpy as np
+import polars as pl
+import mongomock
+import mondongo
+import eda
+import dbSQL
+import instrumentation
+
+BENCHMARK_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "benchmarks")
+BASE_ROWS = 181691  # filas del CSV original del GTD
+SCALES = [0.1, 1]
+# Escalas grandes: solo con allow_large (--large); con mongomock cada fila es un dict en memoria
+LARGE_SCALES = [10, 100]
+MAX_DEFAULT_SCALE = 1
+SEED = 1234
+SAMPLE_INTERVAL = 0.01
+REGRESSION_TOLERANCE = 0.10
+
+REGIONS = [
+    "Central America & Caribbean", "North America", "Southeast Asia", "Western Europe", "East Asia",
+    "South America", "Eastern Europe", "Sub-Saharan Africa", "Middle East & North Africa",
+    "Australasia & Oceania", "South Asia", "Central Asia",
+]
+ATTACK_TYPES = [
+    "Bombing/Explosion", "Armed Assault", "Assassination", "Hostage Taking (Kidnapping)",
+    "Facility/Infrastructure Attack", "Unknown", "Unarmed Assault", "Hostage Taking (Barricade Incident)",
+    "Hijacking",
+]
+TARGET_TYPES = [
+    "Private Citizens & Property", "Military", "Police", "Government (General)", "Business", "Transportation",
+    "Utilities", "Unknown", "Religious Figures/Institutions", "Educational Institution",
+    "Government (Diplomatic)", "Terrorists/Non-State Militia", "Journalists & Media", "Violent Political Party",
+    "Airports & Aircraft", "Telecommunication", "NGO", "Tourists", "Maritime", "Food or Water Supply",
+    "Abortion Related", "Other",
+]
+WEAPON_TYPES = [
+    "Explosives", "Firearms", "Unknown", "Incendiary", "Melee", "Chemical", "Sabotage Equipment",
+    "Vehicle (not to include vehicle-borne explosives, i.e., car or truck bombs)", "Other", "Biological",
+    "Fake Weapons", "Radiological",
+]
+
+# columna: (vocabulario o (prefijo, cardinalidad), exponente de Zipf, tasa de vacíos)
+CATEGORICAL_SPECS = {
+    "country_txt": (("Country", 205), 1.1, 0.0),
+    "provstate": (("Province", 2800), 1.1, 0.02),
+    "city": (("City", 36000), 1.05, 0.003),
+    "gname": (("Group", 3500), 1.2, 0.0),
+    "gsubname": (("Faction", 1200), 1.0, 0.97),
+    "attacktype1_txt": (ATTACK_TYPES, 1.3, 0.0),
+    "targtype1_txt": (TARGET_TYPES, 1.2, 0.0),
+    "corp1": (("Entity", 33000), 1.0, 0.23),
+    "target1": (("Target", 86000), 1.0, 0.003),
+    "weaptype1_txt": (WEAPON_TYPES, 1.4, 0.0),
+    "weapsubtype1_txt": (("Subtype", 30), 1.2, 0.11),
+    "dbsource": (("Source", 26), 1.3, 0.0),
+}
+
+# Resto de columnas del CSV que no usa el modelo estrella: (tipo, tasa de vacíos)
+EXTRA_COLUMNS = {
+    "approxdate": ("text", 0.95), "extended": ("flag", 0.0), "resolution": ("text", 0.98),
+    "specificity": ("small", 0.0), "vicinity": ("flag", 0.0), "location": ("text", 0.69),
+    "summary": ("text", 0.36), "crit1": ("flag", 0.0), "crit2": ("flag", 0.0), "crit3": ("flag", 0.0),
+    "doubtterr": ("flag", 0.0), "multiple": ("flag", 0.0), "nperps": ("count", 0.35),
+    "nperpcap": ("count", 0.38), "claimed": ("flag", 0.36), "nkillus": ("count", 0.35),
+    "nkillter": ("count", 0.37), "nwoundus": ("count", 0.35), "nwoundte": ("count", 0.39),
+    "property": ("flag", 0.0), "propextent": ("small", 0.65), "ishostkid": ("flag", 0.001),
+    "motive": ("text", 0.72), "weapdetail": ("text", 0.37), "scite1": ("text", 0.36),
+    "INT_LOG": ("flag", 0.0), "INT_IDEO": ("flag", 0.0), "INT_MISC": ("flag", 0.0), "INT_ANY": ("flag", 0.0),
+}
+
+def _zipf_indices(rng, n_rows, cardinality, exponent):
+    weights = 1.0 / np.arange(1, cardinality + 1) ** exponent
+    return rng.choice(cardinality, size=n_rows, p=weights / weights.sum())
+
+def _blank(values, rng, empty_rate):
+    """Convierte a texto como en el CSV y deja vacía una fracción de las celdas."""
+    series = pl.Series(values).cast(pl.String)
+    if empty_rate <= 0:
+        return series
+    mask = pl.Series(rng.random(series.len()) < empty_rate)
+    return pl.select(pl.when(mask).then(pl.lit("")).otherwise(series)).to_series()
+
+def generate_gtd(n_rows, seed=SEED):
+    """
+    Genera un DataFrame con la forma del CSV del GTD (todas las columnas
+    como texto, vacíos incluidos) con cardinalidades y tasas de nulos
+    parecidas a las reales. Misma semilla, mismos datos.
+    """
+    rng = np.random.default_rng(seed)
+    # Más incidentes en los años recientes, como en el GTD
+    years = np.arange(1970, 2018)
+    year_weights = np.linspace(1, 6, len(years))
+    iyear = np.sort(rng.choice(years, size=n_rows, p=year_weights / year_weights.sum()))
+    imonth = np.where(rng.random(n_rows) < 0.0001, 0, rng.integers(1, 13, n_rows))
+    iday = np.where(rng.random(n_rows) < 0.005, 0, rng.integers(1, 29, n_rows))
+    eventid = iyear.astype(np.int64) * 10 ** 12 + imonth * 10 ** 10 + iday * 10 ** 8 + np.arange(n_rows) % 10 ** 8
+
+    columns = {
+        "eventid": pl.Series(eventid).cast(pl.String),
+        "iyear": pl.Series(iyear).cast(pl.String),
+        "imonth": pl.Series(imonth).cast(pl.String),
+        "iday": pl.Series(iday).cast(pl.String),
+    }
+    for col, (vocab, exponent, empty_rate) in CATEGORICAL_SPECS.items():
+        if isinstance(vocab, tuple):
+            prefix, cardinality = vocab
+            vocab = ["Unknown"] + [f"{prefix} {i}" for i in range(1, cardinality)]
+        indices = _zipf_indices(rng, n_rows, len(vocab), exponent)
+        columns[col] = _blank(pl.Series(vocab).gather(indices), rng, empty_rate)
+        if col == "country_txt":
+            country_index = indices
+
+    # Cada país pertenece siempre a la misma región
+    columns["region_txt"] = pl.Series(REGIONS).gather(country_index % len(REGIONS))
+    columns["latitude"] = _blank(np.round(rng.uniform(-50, 65, n_rows), 6), rng, 0.025)
+    columns["longitude"] = _blank(np.round(rng.uniform(-150, 170, n_rows), 6), rng, 0.025)
+    columns["success"] = _blank((rng.random(n_rows) < 0.89).astype(np.int64), rng, 0.0)
+    columns["suicide"] = _blank((rng.random(n_rows) < 0.035).astype(np.int64), rng, 0.0)
+    columns["nkill"] = _blank(rng.geometric(0.35, n_rows) - 1, rng, 0.06)
+    columns["nwound"] = _blank(rng.geometric(0.25, n_rows) - 1, rng, 0.09)
+    propvalue = np.round(rng.lognormal(8, 2.5, n_rows), 2)
+    propvalue[rng.random(n_rows) < 0.3] = -99
+    columns["propvalue"] = _blank(propvalue, rng, 0.78)
+
+    for col, (kind, empty_rate) in EXTRA_COLUMNS.items():
+        if kind == "flag":
+            values = rng.integers(0, 2, n_rows)
+        elif kind == "small":
+            values = rng.integers(1, 6, n_rows)
+        elif kind == "count":
+            values = rng.geometric(0.4, n_rows) - 1
+        else:
+            values = pl.Series([f"Texto {i}" for i in range(1000)]).gather(rng.integers(0, 1000, n_rows))
+        columns[col] = _blank(values, rng, empty_rate)
+
+    return pl.DataFrame(columns)
+
+def measure(name, func, *args, **kwargs):
+    """Ejecuta una etapa y retorna (resultado, métricas de tiempo y memoria)."""
+    print(f"\n[benchmark] {name}...")
+    with instrumentation.PeakMemorySampler(SAMPLE_INTERVAL, collect=True) as sampler:
+        cpu_start = time.process_time()
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        seconds = time.perf_counter() - start
+        cpu_seconds = time.process_time() - cpu_start
+    record = {
+        "seconds": seconds,
+        "cpu_seconds": cpu_seconds,
+        "peak_rss_mb": sampler.peak / 1024 ** 2,
+        "rss_delta_mb": (sampler.peak - sampler.baseline) / 1024 ** 2,
+    }
+    frame = result[0] if isinstance(result, tuple) else result
+    if isinstance(frame, pl.DataFrame):
+        record["rows_out"] = frame.height
+        record["columns_out"] = frame.width
+    print(f"[benchmark] {name}: {seconds:.2f}s, pico {record['peak_rss_mb']:.0f} MB "
+          f"(+{record['rss_delta_mb']:.0f} MB)")
+    return result, record
+
+@contextmanager
+def patched(module, **attrs):
+    """Sustituye temporalmente constantes de un módulo (rutas, URI, base de datos)."""
+    originals = {name: getattr(module, name) for name in attrs}
+    for name, value in attrs.items():
+        setattr(module, name, value)
+    try:
+        yield
+    finally:
+        for name, value in originals.items():
+            setattr(module, name, value)
+
+@contextmanager
+def serve_directory(directory):
+    """Sirve un directorio por HTTP local para que upload_data descargue el CSV sintético."""
+    class QuietHandler(SimpleHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(QuietHandler, directory=directory))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+@contextmanager
+def mongo_backend(mode):
+    """
+    - "local": el mongod de mondongo.MONGO_URI, en una base de datos aparte.
+    - "mongomock": un único cliente en memoria compartido por todas las etapas.
+    """
+    if mode == "mongomock":
+        client = mongomock.MongoClient()
+        client.close = lambda: None
+        with patched(mondongo, MongoClient=lambda *args, **kwargs: client):
+            yield
+    else:
+        yield
+
+def run_scale(scale, base_rows=BASE_ROWS, seed=SEED, mongo="mongomock", work_dir=None):
+    """Genera los datos de una escala y mide cada etapa del pipeline sobre ellos."""
+    n_rows = int(base_rows * scale)
+    work_dir = work_dir or os.path.join(BENCHMARK_DIR, f"work-{scale}x")
+    os.makedirs(work_dir, exist_ok=True)
+    stages = {}
+
+    df_csv, stages["generate"] = measure("generate", generate_gtd, n_rows, seed)
+    csv_path = os.path.join(work_dir, "gtd_sintetico.csv")
+    df_csv.write_csv(csv_path)
+    csv_mb = os.path.getsize(csv_path) / 1024 ** 2
+
+    db_file = os.path.join(work_dir, "gtd_benchmark.db")
+    mongo_attrs = {
+        "DATABASE_NAME": "gtd_benchmark",
+        "CHECKPOINT_FILE": os.path.join(work_dir, "mongo_checkpoint.json"),
+    }
+    with patched(mondongo, **mongo_attrs), patched(dbSQL, DB_FILE=db_file):
+        if mongo == "none":
+            df_raw = df_csv
+        else:
+            with mongo_backend(mongo), serve_directory(work_dir) as base_url:
+                with patched(mondongo, CSV_URL=f"{base_url}/gtd_sintetico.csv"):
+                    summary, stages["upload_data"] = measure("upload_data", mondongo.upload_data)
+                    stages["upload_data"]["rows_out"] = summary["rows"]
+                df_raw, stages["get_dataframe"] = measure("get_dataframe", eda.get_dataframe)
+        del df_csv
+
+        df_clean, stages["run_lazy_pipeline"] = measure("run_lazy_pipeline", eda.run_lazy_pipeline, df_raw)
+        _, stages["analyze_data_quality"] = measure("analyze_data_quality", eda.analyze_data_quality, df_raw)
+        del df_raw
+        _, stages["encode_categorical_columns"] = measure(
+            "encode_categorical_columns", eda.encode_categorical_columns, df_clean
+        )
+        _, stages["ejecutar_pipeline_sql"] = measure(
+            "ejecutar_pipeline_sql", dbSQL.ejecutar_pipeline_sql, df_clean, bulk=True
+        )
+        del df_clean
+        _, stages["extraer_dataframe_analitico"] = measure(
+            "extraer_dataframe_analitico", dbSQL.extraer_dataframe_analitico, db_file
+        )
+
+    for record in stages.values():
+        if "rows_out" in record and record["seconds"] > 0:
+            record["rows_per_sec"] = record["rows_out"] / record["seconds"]
+    return {"rows": n_rows, "csv_mb": csv_mb, "stages": stages}
+
+def run_benchmarks(scales=SCALES, base_rows=BASE_ROWS, seed=SEED, mongo="mongomock", output=None, keep=False,
+                   allow_large=False):
+    """
+    Ejecuta la suite en cada escala (1x = tamaño del GTD) y guarda los
+    resultados en JSON para poder comparar ejecuciones. Retorna la ruta.
+    Las escalas mayores que MAX_DEFAULT_SCALE requieren allow_large=True.
+    """
+    large = [scale for scale in scales if scale > MAX_DEFAULT_SCALE]
+    if large and not allow_large:
+        raise ValueError(f"Las escalas {large} superan {MAX_DEFAULT_SCALE}x: actívalas con allow_large=True (--large).")
+    if large and mongo == "mongomock":
+        print(f"Aviso: con mongomock las escalas {large} cargan todas las filas en memoria; "
+              f"considera --mongo local o --mongo none.")
+    results = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "seed": seed,
+        "base_rows": base_rows,
+        "mongo": mongo,
+        "python": sys.version.split()[0],
+        "polars": pl.__version__,
+        "cpu_count": os.cpu_count(),
+        "scales": {},
+    }
+    for scale in scales:
+        print(f"\n=== Escala {scale}x ({int(base_rows * scale)} filas) ===")
+        work_dir = os.path.join(BENCHMARK_DIR, f"work-{scale}x")
+        try:
+            results["scales"][str(scale)] = run_scale(scale, base_rows, seed, mongo, work_dir)
+        finally:
+            if not keep:
+                shutil.rmtree(work_dir, ignore_errors=True)
+
+    output = output or os.path.join(BENCHMARK_DIR, f"benchmark-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResultados guardados en: {output}")
+    return output
+
+def compare_results(baseline_path, current_path, tolerance=REGRESSION_TOLERANCE):
+    """
+    Compara dos ficheros de resultados y retorna las etapas cuya duración o
+    pico de memoria empeoran más que `tolerance` (0.10 = 10 %).
+    """
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(current_path, "r", encoding="utf-8") as f:
+        current = json.load(f)
+
+    regressions = []
+    for scale, data in current["scales"].items():
+        base_stages = baseline["scales"].get(scale, {}).get("stages", {})
+        for stage, record in data["stages"].items():
+            if stage not in base_stages:
+                continue
+            for metric in ("seconds", "peak_rss_mb"):
+                before, after = base_stages[stage][metric], record[metric]
+                if before > 0 and (after - before) / before > tolerance:
+                    regressions.append({
+                        "scale": scale, "stage": stage, "metric": metric,
+                        "baseline": before, "current": after, "change": (after - before) / before,
+                    })
+
+    if regressions:
+        print(f"Se han detectado {len(regressions)} regresiones:")
+        for r in regressions:
+            print(f" - {r['scale']}x {r['stage']} {r['metric']}: {r['baseline']:.2f} -> {r['current']:.2f} "
+                  f"({r['change']:+.0%})")
+    else:
+        print("Sin regresiones respecto a la ejecución base.")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks del pipeline GTD con datos sintéticos.")
+    parser.add_argument("--scales", type=float, nargs="+", default=SCALES)
+    parser.add_argument("--large", action="store_true",
+                        help=f"Permite escalas mayores que {MAX_DEFAULT_SCALE}x (p. ej. --scales {' '.join(map(str, LARGE_SCALES))}).")
+    parser.add_argument("--base-rows", type=int, default=BASE_ROWS)
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--mongo", choices=["mongomock", "local", "none"], default="mongomock",
+                        help="Dónde medir upload_data/get_dataframe ('none' las omite).")
+    parser.add_argument("--output", help="Fichero JSON de resultados.")
+    parser.add_argument("--compare", help="JSON de una ejecución anterior para detectar regresiones.")
+    parser.add_argument("--tolerance", type=float, default=REGRESSION_TOLERANCE)
+    parser.add_argument("--keep", action="store_true", help="Conserva el CSV y la base SQLite generados.")
+    args = parser.parse_args(argv)
+
+    scales = [int(s) if float(s).is_integer() else s for s in args.scales]
+    output = run_benchmarks(scales, args.base_rows, args.seed, args.mongo, args.output, args.keep, args.large)
+    if args.compare:
+        regressions = compare_results(args.compare, output, args.tolerance)
+        sys.exit(1 if regressions else 0)
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,81 @@
 import sqlite3
 from sqlite3 import Error
 import os
+import glob
+import time
 import polars as pl
+import pyarrow.parquet as pq
+import instrumentation
+
+DB_FILE = "data/terrorismo_gtd.db"
+BATCH_SIZE = 50000
+
+# (tabla, id, columnas en el DataFrame, columnas en la tabla)
+DIMENSIONES = [
+    ("TIEMPO", "id_tiempo", ["fecha"], ["fecha"]),
+    ("UBICACION", "id_ubicacion", ["country_txt", "region_txt", "provstate", "city", "latitude", "longitude"],
+     ["country_txt", "region_txt", "provstate", "city", "latitude", "longitude"]),
+    ("GRUPO", "id_grupo", ["gname", "gsubname"], ["gname", "subgname"]),
+    ("METODO", "id_metodo", ["attacktype1_txt", "suicide"], ["attacktype1_txt", "suicide"]),
+    ("OBJETIVO", "id_objetivo", ["targtype1_txt", "corp1", "target1"], ["targtype1_txt", "corp1", "target1"]),
+    ("ARMA", "id_arma", ["weaptype1_txt", "weapsubtype1_txt"], ["weaptype1_txt", "weapsubtype1_txt"]),
+]
+
+FACT_COLUMNS = ["nkill", "nwound", "success", "propvalue",
+                "id_tiempo", "id_ubicacion", "id_grupo", "id_metodo", "id_objetivo"]
+
+TABLA_ANALITICA = "ANALITICO"
+TABLA_CUBO = "CUBO_ATAQUES"
+
+COLUMNAS_ANALITICAS = {
+    "eventid": "f.id_ataque", "nkill": "f.nkill", "nwound": "f.nwound", "success": "f.success", "propvalue": "f.propvalue",
+    "fecha": "t.fecha",
+    "country_txt": "u.country_txt", "region_txt": "u.region_txt", "provstate": "u.provstate", "city": "u.city",
+    "latitude": "u.latitude", "longitude": "u.longitude",
+    "gname": "g.gname", "gsubname": "g.subgname",
+    "attacktype1_txt": "m.attacktype1_txt", "suicide": "m.suicide",
+    "targtype1_txt": "o.targtype1_txt", "corp1": "o.corp1", "target1": "o.target1",
+    "weaptype1_txt": "a.weaptype1_txt", "weapsubtype1_txt": "a.weapsubtype1_txt",
+}
+
+TIPOS_ANALITICOS = {
+    "eventid": pl.Int64, "nkill": pl.Int64, "nwound": pl.Int64, "success": pl.Int64, "propvalue": pl.Float64,
+    "fecha": pl.String,
+    "country_txt": pl.String, "region_txt": pl.String, "provstate": pl.String, "city": pl.String,
+    "latitude": pl.Float64, "longitude": pl.Float64,
+    "gname": pl.String, "gsubname": pl.String,
+    "attacktype1_txt": pl.String, "suicide": pl.Int64,
+    "targtype1_txt": pl.String, "corp1": pl.String, "target1": pl.String,
+    "weaptype1_txt": pl.String, "weapsubtype1_txt": pl.String,
+}
+
+SQL_JOIN_ANALITICO = """
+    FROM FACT_ATAQUES f
+    LEFT JOIN TIEMPO t ON f.id_tiempo = t.id_tiempo
+    LEFT JOIN UBICACION u ON f.id_ubicacion = u.id_ubicacion
+    LEFT JOIN GRUPO g ON f.id_grupo = g.id_grupo
+    LEFT JOIN METODO m ON f.id_metodo = m.id_metodo
+    LEFT JOIN OBJETIVO o ON f.id_objetivo = o.id_objetivo
+    LEFT JOIN PUENTE_USA pu ON f.id_ataque = pu.id_ataque
+    LEFT JOIN ARMA a ON pu.id_arma = a.id_arma
+"""
+
+NATURAL_KEY_INDEXES = {
+    f"ux_{tabla.lower()}": f"CREATE UNIQUE INDEX IF NOT EXISTS ux_{tabla.lower()} ON {tabla} ({', '.join(columnas)});"
+    for tabla, _, _, columnas in DIMENSIONES
+}
+
+SECONDARY_INDEXES = {
+    "idx_fact_tiempo": "CREATE INDEX IF NOT EXISTS idx_fact_tiempo ON FACT_ATAQUES (id_tiempo);",
+    "idx_fact_ubicacion": "CREATE INDEX IF NOT EXISTS idx_fact_ubicacion ON FACT_ATAQUES (id_ubicacion);",
+    "idx_fact_grupo": "CREATE INDEX IF NOT EXISTS idx_fact_grupo ON FACT_ATAQUES (id_grupo);",
+    "idx_fact_metodo": "CREATE INDEX IF NOT EXISTS idx_fact_metodo ON FACT_ATAQUES (id_metodo);",
+    "idx_fact_objetivo": "CREATE INDEX IF NOT EXISTS idx_fact_objetivo ON FACT_ATAQUES (id_objetivo);",
+    "idx_puente_arma": "CREATE INDEX IF NOT EXISTS idx_puente_arma ON PUENTE_USA (id_arma);",
+}
+
+# PUENTE_USA ya se busca por id_ataque con su clave primaria (id_ataque, id_arma)
+INDICES_OBSOLETOS = ["idx_puente_ataque"]
 
 def create_connection(db_file):
     conn = None
@@ -61,48 +135,198 @@ def crear_esquema(conn):
     for sql in [sql_tiempo, sql_ubicacion, sql_grupo, sql_metodo, sql_objetivo, sql_arma, sql_fact, sql_puente]:
         execute_sql(conn, sql)
 
-def procesar_dimension(df_principal, columnas_clave, nombre_id):
-    df_dim = df_principal.select(columnas_clave).unique().drop_nulls()
-    df_dim = df_dim.with_row_index(name=nombre_id, offset=1)
-    df_dim = df_dim.select([nombre_id] + columnas_clave)
-    df_con_fk = df_principal.join(df_dim, on=columnas_clave, how="left")
-    return df_dim.to_numpy().tolist(), df_con_fk
+def crear_indices(conn):
+    for nombre in INDICES_OBSOLETOS:
+        execute_sql(conn, f"DROP INDEX IF EXISTS {nombre};")
+    for sql in list(NATURAL_KEY_INDEXES.values()) + list(SECONDARY_INDEXES.values()):
+        execute_sql(conn, sql)
+
+def eliminar_indices(conn):
+    for nombre in list(NATURAL_KEY_INDEXES) + list(SECONDARY_INDEXES):
+        execute_sql(conn, f"DROP INDEX IF EXISTS {nombre};")
+
+def configurar_carga_masiva(conn, journal_mode="WAL"):
+    """PRAGMAs para la carga: journal ligero, sin fsync, cache grande y FK diferidas."""
+    conn.execute("PRAGMA foreign_keys = 0")
+    conn.execute(f"PRAGMA journal_mode = {journal_mode}")
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute("PRAGMA cache_size = -262144")
+    conn.execute("PRAGMA temp_store = MEMORY")
+
+def restaurar_carga_masiva(conn):
+    """Vuelve a activar las FK y el fsync; fuera de una transacción, o SQLite lo ignora."""
+    conn.execute("PRAGMA foreign_keys = 1")
+    conn.execute("PRAGMA synchronous = FULL")
+
+def verificar_claves_foraneas(conn):
+    """
+    Comprueba las FK de la carga antes del commit. Si hay violaciones deshace
+    la transacción y lanza IntegrityError, para no guardar filas huérfanas.
+    """
+    violaciones = conn.execute("PRAGMA foreign_key_check").fetchall()
+    if violaciones:
+        conn.rollback()
+        restaurar_carga_masiva(conn)
+        raise sqlite3.IntegrityError(
+            f"{len(violaciones)} filas violan claves foráneas (ej. {violaciones[0]}); carga deshecha."
+        )
+
+def filas_arrow(df, batch_size=BATCH_SIZE):
+    """
+    Genera las filas como tuplas a partir de lotes Arrow, columna a columna,
+    sin pasar por arrays NumPy de tipo object.
+    """
+    for batch in df.to_arrow().to_batches(max_chunksize=batch_size):
+        yield from zip(*(col.to_pylist() for col in batch.columns))
 
-def procesar_e_insertar(conn, df_raw, columnas_clave, nombre_id, funcion_insertar):
-    print(f"Procesando dimensión: {nombre_id}...")
-    datos, df_con_fk = procesar_dimension(df_raw, columnas_clave, nombre_id)
-    funcion_insertar(conn, datos)
-    return df_con_fk
+def hash_clave(columnas):
+    """
+    Hash de 64 bits de la clave natural. Las columnas se normalizan a texto
+    para que el hash no dependa del tipo con el que llegan (p. ej. suicide
+    como '0' o 0). Nulo si falta alguna parte de la clave.
+    """
+    return (
+        pl.when(pl.any_horizontal([pl.col(c).is_null() for c in columnas]))
+        .then(None)
+        .otherwise(pl.struct([pl.col(c).cast(pl.String) for c in columnas]).hash(seed=0))
+    )
+
+def keymap_path(db_file):
+    # El hash de Polars no es estable entre versiones: una caché por versión
+    return f"{os.path.splitext(db_file)[0]}.keymap-{pl.__version__}.parquet"
+
+def leer_dimension(conn, tabla, nombre_id, columnas_df, columnas_tabla):
+    """Lee los miembros existentes de una dimensión con los nombres del DataFrame."""
+    select = ", ".join([nombre_id] + [f"{t} AS {c}" for c, t in zip(columnas_df, columnas_tabla)])
+    return pl.read_database(f"SELECT {select} FROM {tabla}", conn)
+
+def resumen_dimensiones(conn):
+    """
+    Número de miembros y id máximo de cada dimensión en la BD, contando solo
+    los miembros con clave natural completa (los únicos que entran en la caché).
+    """
+    resumen = {}
+    for tabla, nombre_id, _, columnas_tabla in DIMENSIONES:
+        completos = " AND ".join(f"{c} IS NOT NULL" for c in columnas_tabla)
+        n, maximo = conn.execute(f"SELECT COUNT(*), MAX({nombre_id}) FROM {tabla} WHERE {completos}").fetchone()
+        resumen[tabla] = (n, maximo)
+    return resumen
+
+def keymap_valido(keymap, conn):
+    """Comprueba que la caché coincide con las dimensiones de la BD (filas e id máximo)."""
+    en_cache = {
+        fila["dimension"]: (fila["n"], fila["maximo"])
+        for fila in keymap.group_by("dimension").agg(
+            pl.len().alias("n"), pl.col("id").max().alias("maximo")
+        ).iter_rows(named=True)
+    }
+    return all(
+        en_cache.get(tabla, (0, None)) == esperado
+        for tabla, esperado in resumen_dimensiones(conn).items()
+    )
 
-def insert_generic(conn, sql, data):
+def cargar_keymap(conn, db_file):
+    """
+    Carga la caché hash -> id guardada junto a la BD. Si no existe, es de
+    otra versión de Polars o no coincide con las dimensiones de la BD (p. ej.
+    la BD se ha borrado o recreado), se reconstruye leyendo las dimensiones.
+    """
+    path = keymap_path(db_file)
+    if os.path.exists(path):
+        keymap = pl.read_parquet(path)
+        if keymap_valido(keymap, conn):
+            return keymap
+        print("La caché de claves no coincide con la base de datos, se descarta.")
+
+    print("Reconstruyendo caché de claves desde la base de datos...")
+    frames = []
+    for tabla, nombre_id, columnas_df, columnas_tabla in DIMENSIONES:
+        df_dim = leer_dimension(conn, tabla, nombre_id, columnas_df, columnas_tabla)
+        frames.append(df_dim.select(
+            pl.lit(tabla).alias("dimension"),
+            hash_clave(columnas_df).alias("hash"),
+            pl.col(nombre_id).cast(pl.Int64).alias("id"),
+        ))
+    return pl.concat(frames).drop_nulls("hash")
+
+def guardar_keymap(keymap, db_file):
+    path = keymap_path(db_file)
+    for antiguo in glob.glob(f"{os.path.splitext(db_file)[0]}.keymap-*.parquet"):
+        if antiguo != path:
+            os.remove(antiguo)
+    keymap.write_parquet(path)
+
+def resolver_claves(df, keymap):
+    """
+    Asigna las claves subrogadas de todas las dimensiones en una sola pasada:
+    un hash por clave natural, ids nuevos (max + 1) solo para los hashes que
+    no están en la caché, y un único with_columns que traduce hash -> id.
+    Retorna (df_con_ids, keymap_actualizado, miembros_nuevos_por_tabla).
+    """
+    df = df.with_columns([hash_clave(cols).alias(f"_h_{nombre_id}") for _, nombre_id, cols, _ in DIMENSIONES])
+
+    nuevos = {}
+    for tabla, nombre_id, columnas_df, _ in DIMENSIONES:
+        h = f"_h_{nombre_id}"
+        conocidos = keymap.filter(pl.col("dimension") == tabla)
+        siguiente = (conocidos["id"].max() or 0) + 1
+        df_nuevos = (
+            df.select([h] + columnas_df)
+            .drop_nulls(h)
+            .unique(subset=h, keep="first", maintain_order=True)
+            .join(conocidos, left_on=h, right_on="hash", how="anti")
+            .with_row_index(nombre_id, offset=siguiente)
+            .with_columns(pl.col(nombre_id).cast(pl.Int64))
+        )
+        nuevos[tabla] = df_nuevos.select([nombre_id] + columnas_df)
+        keymap = pl.concat([
+            keymap,
+            df_nuevos.select(pl.lit(tabla).alias("dimension"), pl.col(h).alias("hash"), pl.col(nombre_id).alias("id")),
+        ])
+
+    exprs = []
+    for tabla, nombre_id, _, _ in DIMENSIONES:
+        mapa = keymap.filter(pl.col("dimension") == tabla)
+        exprs.append(
+            pl.col(f"_h_{nombre_id}")
+            .replace_strict(mapa["hash"], mapa["id"], default=None, return_dtype=pl.Int64)
+            .alias(nombre_id)
+        )
+    df = df.with_columns(exprs).drop([f"_h_{nombre_id}" for _, nombre_id, _, _ in DIMENSIONES])
+    return df, keymap, nuevos
+
+def miembros_dimension(df, nombre_id, columnas_df):
+    return df.select([nombre_id] + columnas_df).drop_nulls(nombre_id).unique(subset=nombre_id, keep="first")
+
+def insert_generic(conn, sql, data, commit=True, propagar=False):
+    """
+    Inserta las filas con executemany. Con propagar=True el error se relanza
+    en lugar de imprimirse, para que la transacción del llamante haga rollback.
+    """
+    if isinstance(data, pl.DataFrame):
+        data = filas_arrow(data)
     try:
         c = conn.cursor()
         c.executemany(sql, data)
-        conn.commit()
+        if commit:
+            conn.commit()
     except Error as e:
+        if propagar:
+            raise
         print(f"Error insert: {e}")
 
-def insertar_tiempo(conn, d): insert_generic(conn,'INSERT INTO TIEMPO(id_tiempo, fecha) VALUES(?,?)', d)
-def insertar_ubicacion(conn, d): insert_generic(conn,'INSERT INTO UBICACION(id_ubicacion, country_txt, region_txt, provstate, city, latitude, longitude) VALUES(?,?,?,?,?,?,?)', d)
-def insertar_grupo(conn, d): insert_generic(conn, 'INSERT INTO GRUPO(id_grupo, gname, subgname) VALUES(?,?,?)', d)
-def insertar_metodo(conn, d): insert_generic(conn,'INSERT INTO METODO(id_metodo, attacktype1_txt, suicide) VALUES(?,?,?)', d)
-def insertar_objetivo(conn, d): insert_generic(conn,'INSERT INTO OBJETIVO(id_objetivo, targtype1_txt, corp1, target1) VALUES(?,?,?,?)', d)
-def insertar_arma(conn, d): insert_generic(conn,'INSERT INTO ARMA(id_arma, weaptype1_txt, weapsubtype1_txt) VALUES(?,?,?)', d)
-def insertar_fact(conn, d): insert_generic(conn,'INSERT INTO FACT_ATAQUES(id_ataque, nkill, nwound, success, propvalue, id_tiempo, id_ubicacion, id_grupo, id_metodo, id_objetivo) VALUES(?,?,?,?,?,?,?,?,?,?)', d)
-def insertar_puente(conn, d): insert_generic(conn,'INSERT INTO PUENTE_USA(id_ataque, id_arma) VALUES(?,?)', d)
-
-def ejecutar_pipeline_sql(df):
-    db_file = "data/terrorismo_gtd.db"
-    print(f"\nIniciando SQL Pipeline en: {db_file}")
-
-    conn = create_connection(db_file)
-    if not conn: return
-
-    crear_esquema(conn)
-    limpiar_tablas(conn)
+def insertar_tiempo(conn, d, commit=True, propagar=False): insert_generic(conn,'INSERT INTO TIEMPO(id_tiempo, fecha) VALUES(?,?)', d, commit, propagar)
+def insertar_ubicacion(conn, d, commit=True, propagar=False): insert_generic(conn,'INSERT INTO UBICACION(id_ubicacion, country_txt, region_txt, provstate, city, latitude, longitude) VALUES(?,?,?,?,?,?,?)', d, commit, propagar)
+def insertar_grupo(conn, d, commit=True, propagar=False): insert_generic(conn, 'INSERT INTO GRUPO(id_grupo, gname, subgname) VALUES(?,?,?)', d, commit, propagar)
+def insertar_metodo(conn, d, commit=True, propagar=False): insert_generic(conn,'INSERT INTO METODO(id_metodo, attacktype1_txt, suicide) VALUES(?,?,?)', d, commit, propagar)
+def insertar_objetivo(conn, d, commit=True, propagar=False): insert_generic(conn,'INSERT INTO OBJETIVO(id_objetivo, targtype1_txt, corp1, target1) VALUES(?,?,?,?)', d, commit, propagar)
+def insertar_arma(conn, d, commit=True, propagar=False): insert_generic(conn,'INSERT INTO ARMA(id_arma, weaptype1_txt, weapsubtype1_txt) VALUES(?,?,?)', d, commit, propagar)
+def insertar_fact(conn, d, commit=True, propagar=False): insert_generic(conn,'INSERT INTO FACT_ATAQUES(id_ataque, nkill, nwound, success, propvalue, id_tiempo, id_ubicacion, id_grupo, id_metodo, id_objetivo) VALUES(?,?,?,?,?,?,?,?,?,?)', d, commit, propagar)
+def insertar_puente(conn, d, commit=True, propagar=False): insert_generic(conn,'INSERT INTO PUENTE_USA(id_ataque, id_arma) VALUES(?,?)', d, commit, propagar)
 
+def unificar_fecha(df):
     print("Unificando año-mes-día en columna 'fecha'...")
-    df = df.with_columns(
+    return df.with_columns(
         pl.date(
             pl.col("iyear"),
             pl.col("imonth").replace(0, 1), 
@@ -110,16 +334,141 @@ def ejecutar_pipeline_sql(df):
         ).cast(pl.String).alias("fecha")
     )
 
-    # Pipeline de Dimensiones
-    df = procesar_e_insertar(conn, df, ["fecha"], "id_tiempo", insertar_tiempo)
-    df = procesar_e_insertar(conn, df, ["country_txt", "region_txt", "provstate", "city", "latitude", "longitude"], "id_ubicacion", insertar_ubicacion)
-    df = procesar_e_insertar(conn, df, ["gname", "gsubname"], "id_grupo", insertar_grupo)
-    df = procesar_e_insertar(conn, df, ["attacktype1_txt", "suicide"], "id_metodo", insertar_metodo)
-    df = procesar_e_insertar(conn, df, ["targtype1_txt", "corp1", "target1"], "id_objetivo", insertar_objetivo)
+def upsert_dimension(conn, df_nuevos, tabla, nombre_id, columnas_tabla):
+    """Inserta los miembros nuevos con su id; INSERT OR IGNORE respeta la clave natural única."""
+    columnas = ", ".join([nombre_id] + columnas_tabla)
+    placeholders = ", ".join("?" for _ in range(len(columnas_tabla) + 1))
+    insert_generic(conn, f"INSERT OR IGNORE INTO {tabla} ({columnas}) VALUES ({placeholders})", df_nuevos,
+                   commit=False, propagar=True)
+    print(f" - {tabla}: {df_nuevos.height} miembros nuevos.")
+
+def hash_filas(df, columnas):
+    return df.with_columns(pl.struct(columnas).hash(seed=0).alias("_hash"))
+
+@instrumentation.stage
+def ejecutar_pipeline_incremental(df, db_file=DB_FILE, materializar=True):
+    """
+    Mantiene el modelo estrella de forma incremental: las dimensiones
+    conservan sus ids (caché de claves hash + INSERT OR IGNORE) y solo se
+    insertan o actualizan las filas de FACT_ATAQUES y PUENTE_USA que son
+    nuevas o han cambiado. No borra hechos que ya no estén en el origen.
+    """
+    print(f"\nIniciando SQL Pipeline incremental en: {db_file}")
+
+    conn = create_connection(db_file)
+    if not conn: return
+
+    crear_esquema(conn)
+    crear_indices(conn)
 
-    print("Procesando Armas y Puente...")
-    datos_arma, df_con_arma = procesar_dimension(df, ["weaptype1_txt", "weapsubtype1_txt"], "id_arma")
-    insertar_arma(conn, datos_arma)
+    if "eventid" not in df.columns:
+        print("ERROR: Falta la columna 'eventid'. Recupérala del dataframe original.")
+        conn.close()
+        return
+
+    df = unificar_fecha(df)
+    try:
+        df, keymap, nuevos = resolver_claves(df, cargar_keymap(conn, db_file))
+        for tabla, nombre_id, _, columnas_tabla in DIMENSIONES:
+            upsert_dimension(conn, nuevos[tabla], tabla, nombre_id, columnas_tabla)
+
+        # Hechos: solo filas nuevas o con contenido distinto
+        cols_fact = ["eventid"] + FACT_COLUMNS
+        df_fact = df.select(cols_fact).drop_nulls(subset=["eventid"]).with_columns(
+            [pl.col(c).cast(pl.Int64) for c in cols_fact if c != "propvalue"]
+            + [pl.col("propvalue").cast(pl.Float64)]
+        )
+        actual = pl.read_database(f"SELECT id_ataque AS eventid, {', '.join(FACT_COLUMNS)} FROM FACT_ATAQUES", conn)
+        actual = actual.with_columns([pl.col(c).cast(df_fact.schema[c]) for c in cols_fact])
+        df_cambios = hash_filas(df_fact, cols_fact).join(
+            hash_filas(actual, cols_fact).select(["eventid", "_hash"]), on=["eventid", "_hash"], how="anti"
+        ).drop("_hash")
+
+        set_clause = ", ".join(f"{c} = excluded.{c}" for c in FACT_COLUMNS)
+        insert_generic(
+            conn,
+            f"INSERT INTO FACT_ATAQUES(id_ataque, {', '.join(FACT_COLUMNS)}) VALUES({', '.join('?' for _ in cols_fact)}) "
+            f"ON CONFLICT(id_ataque) DO UPDATE SET {set_clause}",
+            df_cambios, commit=False, propagar=True,
+        )
+        print(f"Hechos nuevos o modificados: {df_cambios.height} de {df_fact.height}")
+
+        # Puente: se reemplazan las armas de los ataques cuyo par ha cambiado
+        df_puente = df.select(["eventid", "id_arma"]).drop_nulls().with_columns(pl.all().cast(pl.Int64))
+        puente_actual = pl.read_database("SELECT id_ataque AS eventid, id_arma FROM PUENTE_USA", conn)
+        puente_actual = puente_actual.with_columns(pl.all().cast(pl.Int64))
+        df_puente_nuevo = df_puente.join(puente_actual, on=["eventid", "id_arma"], how="anti")
+        insert_generic(conn, "DELETE FROM PUENTE_USA WHERE id_ataque = ?", df_puente_nuevo.select("eventid"),
+                       commit=False, propagar=True)
+        insertar_puente(conn, df_puente_nuevo, commit=False, propagar=True)
+        print(f"Relaciones de armas nuevas o modificadas: {df_puente_nuevo.height}")
+
+        conn.commit()
+        guardar_keymap(keymap, db_file)
+        if materializar:
+            refrescar_tabla_analitica(conn)
+            refrescar_cubo(conn)
+        else:
+            for tabla in [TABLA_ANALITICA, TABLA_CUBO]:
+                execute_sql(conn, f"DROP TABLE IF EXISTS {tabla};")
+    except Exception as e:
+        conn.rollback()
+        print(f"Error en la carga incremental: {e}")
+        conn.close()
+        return
+
+    conn.close()
+    return {"hechos": df_cambios.height, "puente": df_puente_nuevo.height}
+
+@instrumentation.stage
+def ejecutar_pipeline_sql(df, bulk=False, journal_mode="WAL", incremental=False, materializar=True, db_file=None):
+    """
+    Construye el modelo estrella en SQLite. Con bulk=True la carga se hace
+    en una sola transacción, con PRAGMAs de carga, FK comprobadas antes del
+    commit (si fallan se deshace la carga y se lanza IntegrityError) e
+    índices secundarios creados después de insertar los datos.
+    Con incremental=True se delega en ejecutar_pipeline_incremental.
+    Con materializar=True se refresca al final la tabla desnormalizada
+    ANALITICO. db_file es por defecto DB_FILE. Retorna el tiempo de carga por tabla.
+    """
+    db_file = db_file or DB_FILE
+    if incremental:
+        return ejecutar_pipeline_incremental(df, db_file, materializar=materializar)
+
+    print(f"\nIniciando SQL Pipeline en: {db_file}")
+
+    conn = create_connection(db_file)
+    if not conn: return
+
+    crear_esquema(conn)
+    limpiar_tablas(conn)
+    commit = not bulk
+    if bulk:
+        print(f"Modo carga masiva (journal_mode={journal_mode})...")
+        configurar_carga_masiva(conn, journal_mode)
+        eliminar_indices(conn)
+
+    tiempos = {}
+    def cronometrar(tabla, funcion, *args):
+        inicio = time.perf_counter()
+        resultado = funcion(*args)
+        tiempos[tabla] = time.perf_counter() - inicio
+        return resultado
+
+    df = unificar_fecha(df)
+
+    # Claves subrogadas de todas las dimensiones en una pasada
+    print("Resolviendo claves de dimensiones...")
+    df, keymap, _ = cronometrar("CLAVES", resolver_claves, df, cargar_keymap(conn, db_file))
+
+    # Pipeline de Dimensiones
+    insertores = {
+        "TIEMPO": insertar_tiempo, "UBICACION": insertar_ubicacion, "GRUPO": insertar_grupo,
+        "METODO": insertar_metodo, "OBJETIVO": insertar_objetivo, "ARMA": insertar_arma,
+    }
+    for tabla, nombre_id, columnas_df, _ in DIMENSIONES:
+        print(f"Procesando dimensión: {nombre_id}...")
+        cronometrar(tabla, insertores[tabla], conn, miembros_dimension(df, nombre_id, columnas_df), commit)
 
     # Pipeline de Hechos
     cols_fact = ["eventid", "nkill", "nwound", "success", "propvalue",
@@ -131,44 +480,213 @@ def ejecutar_pipeline_sql(df):
         return
 
     df_fact = df.select(cols_fact).drop_nulls(subset=["eventid"])
-    insertar_fact(conn, df_fact.to_numpy().tolist())
+    cronometrar("FACT_ATAQUES", insertar_fact, conn, df_fact, commit)
     print(f"Hechos insertados: {df_fact.height}")
 
     # Pipeline Puente
-    df_puente = df_con_arma.select(["eventid", "id_arma"]).drop_nulls()
-    insertar_puente(conn, df_puente.to_numpy().tolist())
+    df_puente = df.select(["eventid", "id_arma"]).drop_nulls()
+    cronometrar("PUENTE_USA", insertar_puente, conn, df_puente, commit)
+
+    if bulk:
+        try:
+            verificar_claves_foraneas(conn)
+        except sqlite3.IntegrityError:
+            crear_indices(conn)
+            conn.close()
+            raise
+        inicio = time.perf_counter()
+        conn.commit()
+        tiempos["COMMIT"] = time.perf_counter() - inicio
+        restaurar_carga_masiva(conn)
+
+    cronometrar("INDICES", crear_indices, conn)
+    conn.commit()
+    guardar_keymap(keymap, db_file)
+
+    if materializar:
+        cronometrar(TABLA_ANALITICA, refrescar_tabla_analitica, conn)
+        cronometrar(TABLA_CUBO, refrescar_cubo, conn)
+    else:
+        # Sin refresco, una tabla materializada anterior quedaría obsoleta
+        for tabla in [TABLA_ANALITICA, TABLA_CUBO]:
+            execute_sql(conn, f"DROP TABLE IF EXISTS {tabla};")
+
+    print("Tiempos de carga por tabla:")
+    for tabla, segundos in tiempos.items():
+        print(f" - {tabla}: {segundos:.3f}s")
     
     conn.close()
+    return tiempos
+
+def tabla_existe(conn, tabla):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (tabla,)).fetchone() is not None
+
+@instrumentation.stage
+def refrescar_tabla_analitica(conn):
+    """Regenera la tabla desnormalizada ANALITICO con sus índices de filtrado."""
+    inicio = time.perf_counter()
+    select = ", ".join(f"{expr} AS {nombre}" for nombre, expr in COLUMNAS_ANALITICAS.items())
+    conn.execute(f"DROP TABLE IF EXISTS {TABLA_ANALITICA}")
+    conn.execute(f"CREATE TABLE {TABLA_ANALITICA} AS SELECT {select} {SQL_JOIN_ANALITICO}")
+    for columna in ["fecha", "country_txt", "region_txt", "gname"]:
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_analitico_{columna} ON {TABLA_ANALITICA} ({columna})")
+    conn.commit()
+    print(f"Tabla {TABLA_ANALITICA} refrescada en {time.perf_counter() - inicio:.2f}s.")
+
+@instrumentation.stage
+def refrescar_cubo(conn):
+    """
+    Regenera el cubo de agregados (año × región × país × grupo × arma ×
+    tipo de ataque × éxito) que alimenta los gráficos del EDA.
+    """
+    inicio = time.perf_counter()
+    if tabla_existe(conn, TABLA_ANALITICA):
+        origen = TABLA_ANALITICA
+    else:
+        select = ", ".join(f"{expr} AS {nombre}" for nombre, expr in COLUMNAS_ANALITICAS.items())
+        origen = f"(SELECT {select} {SQL_JOIN_ANALITICO})"
+    conn.execute(f"DROP TABLE IF EXISTS {TABLA_CUBO}")
+    conn.execute(f"""CREATE TABLE {TABLA_CUBO} AS
+        SELECT CAST(substr(fecha, 1, 4) AS INTEGER) AS iyear, region_txt, country_txt, gname,
+               weaptype1_txt, attacktype1_txt, success,
+               COUNT(*) AS n_ataques, SUM(nkill) AS nkill, SUM(nwound) AS nwound
+        FROM {origen}
+        GROUP BY 1, 2, 3, 4, 5, 6, 7""")
+    conn.commit()
+    print(f"Tabla {TABLA_CUBO} refrescada en {time.perf_counter() - inicio:.2f}s.")
+
+@instrumentation.stage
+def extraer_cubo(db_file=DB_FILE):
+    conn = create_connection(db_file)
+    if not conn: return None
+    try:
+        return leer_consulta(conn, f"SELECT * FROM {TABLA_CUBO}")
+    finally:
+        conn.close()
+
+def _condicion_in(expr, valores, params):
+    valores = [valores] if isinstance(valores, (str, int)) else list(valores)
+    params.extend(valores)
+    return f"{expr} IN ({', '.join('?' for _ in valores)})"
+
+def construir_consulta_analitica(columnas=None, anios=None, pais=None, region=None, grupo=None, materializada=False):
+    """
+    Construye la consulta analítica parametrizada: solo las columnas pedidas
+    y los filtros (rango de años, país, región, grupo) se resuelven en SQL.
+    Retorna (sql, parametros).
+    """
+    columnas = columnas or list(COLUMNAS_ANALITICAS)
+    desconocidas = set(columnas) - set(COLUMNAS_ANALITICAS)
+    if desconocidas:
+        raise ValueError(f"Columnas no disponibles: {desconocidas}")
+
+    if materializada:
+        ref = {nombre: nombre for nombre in COLUMNAS_ANALITICAS}
+        origen = f"FROM {TABLA_ANALITICA}"
+    else:
+        ref = COLUMNAS_ANALITICAS
+        origen = SQL_JOIN_ANALITICO
+
+    params = []
+    condiciones = []
+    if anios is not None:
+        inicio, fin = anios
+        condiciones.append(f"{ref['fecha']} >= ? AND {ref['fecha']} < ?")
+        params.extend([f"{inicio:04d}-01-01", f"{fin + 1:04d}-01-01"])
+    if pais is not None:
+        condiciones.append(_condicion_in(ref["country_txt"], pais, params))
+    if region is not None:
+        condiciones.append(_condicion_in(ref["region_txt"], region, params))
+    if grupo is not None:
+        condiciones.append(_condicion_in(ref["gname"], grupo, params))
 
-def extraer_dataframe_analitico(db_file="data/terrorismo_gtd.db"):
+    select = ", ".join(
+        nombre if materializada else f"{ref[nombre]} AS {nombre}" for nombre in columnas
+    )
+    sql = f"SELECT {select} {origen}"
+    if condiciones:
+        sql += " WHERE " + " AND ".join(condiciones)
+    return sql, params
+
+def leer_consulta(conn, sql, params=()):
+    cursor = conn.execute(sql, params)
+    columnas = [d[0] for d in cursor.description]
+    return pl.DataFrame(cursor.fetchall(), schema=columnas, orient="row", infer_schema_length=None)
+
+@instrumentation.stage
+def extraer_dataframe_analitico(db_file=DB_FILE, columnas=None, anios=None, pais=None, region=None, grupo=None):
+    """
+    Extrae el DataFrame analítico. Sin argumentos devuelve todas las columnas
+    y filas; con `columnas` y filtros (anios=(inicio, fin), pais, region,
+    grupo) solo se lee la porción pedida. Usa la tabla materializada
+    ANALITICO si existe y, si no, el JOIN del modelo estrella.
+    """
     print(f"Extrayendo datos de: {db_file}...")
     conn = create_connection(db_file)
     if not conn: return None
     
-    query = """
-    SELECT 
-        f.id_ataque as eventid, f.nkill, f.nwound, f.success, f.propvalue,
-        t.fecha,
-        u.country_txt, u.region_txt, u.provstate, u.city, u.latitude, u.longitude,
-        g.gname, g.subgname as gsubname,
-        m.attacktype1_txt, m.suicide,
-        o.targtype1_txt, o.corp1, o.target1,
-        a.weaptype1_txt, a.weapsubtype1_txt
-    FROM FACT_ATAQUES f
-    LEFT JOIN TIEMPO t ON f.id_tiempo = t.id_tiempo
-    LEFT JOIN UBICACION u ON f.id_ubicacion = u.id_ubicacion
-    LEFT JOIN GRUPO g ON f.id_grupo = g.id_grupo
-    LEFT JOIN METODO m ON f.id_metodo = m.id_metodo
-    LEFT JOIN OBJETIVO o ON f.id_objetivo = o.id_objetivo
-    LEFT JOIN PUENTE_USA pu ON f.id_ataque = pu.id_ataque
-    LEFT JOIN ARMA a ON pu.id_arma = a.id_arma
-    """
     try:
-        df_sql = pl.read_database(query, conn)
+        materializada = tabla_existe(conn, TABLA_ANALITICA)
+        query, params = construir_consulta_analitica(columnas, anios, pais, region, grupo, materializada)
+        df_sql = leer_consulta(conn, query, params)
         print(f"Extracción completada: {df_sql.height} filas.")
         conn.close()
         return df_sql
     except Exception as e:
         print(f"Error al extraer datos: {e}")
         conn.close()
-        return None
\ No newline at end of file
+        return None
+
+def iterar_lotes_analiticos(db_file=DB_FILE, batch_size=BATCH_SIZE, columnas=None, anios=None, pais=None, region=None, grupo=None):
+    """
+    Lee el DataFrame analítico por lotes de `batch_size` filas desde el
+    cursor de SQLite, con esquema fijo. La memoria queda acotada al lote
+    y el consumidor puede empezar a trabajar con el primero.
+    """
+    conn = create_connection(db_file)
+    if not conn: return
+    try:
+        materializada = tabla_existe(conn, TABLA_ANALITICA)
+        query, params = construir_consulta_analitica(columnas, anios, pais, region, grupo, materializada)
+        cursor = conn.execute(query, params)
+        nombres = [d[0] for d in cursor.description]
+        schema = {nombre: TIPOS_ANALITICOS[nombre] for nombre in nombres}
+        while True:
+            filas = cursor.fetchmany(batch_size)
+            if not filas:
+                break
+            yield pl.DataFrame(filas, schema=schema, orient="row")
+    finally:
+        conn.close()
+
+@instrumentation.stage
+def exportar_analitico_parquet(parquet_file, db_file=DB_FILE, batch_size=BATCH_SIZE, **filtros):
+    """Vuelca el DataFrame analítico a Parquet lote a lote, sin materializarlo entero."""
+    print(f"Exportando datos analíticos a: {parquet_file}...")
+    directory = os.path.dirname(parquet_file)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+
+    writer = None
+    total = 0
+    try:
+        for lote in iterar_lotes_analiticos(db_file, batch_size, **filtros):
+            tabla = lote.to_arrow()
+            if writer is None:
+                writer = pq.ParquetWriter(parquet_file, tabla.schema)
+            writer.write_table(tabla)
+            total += lote.height
+    finally:
+        if writer is not None:
+            writer.close()
+    print(f"Exportación completada: {total} filas.")
+    return total
+
+def extraer_analitico_lazy(parquet_file="data/analitico.parquet", db_file=DB_FILE, batch_size=BATCH_SIZE, **filtros):
+    """
+    Exporta por lotes a Parquet y devuelve un LazyFrame sobre el fichero,
+    listo para encadenar el pipeline lazy/streaming de eda.
+    """
+    if exportar_analitico_parquet(parquet_file, db_file, batch_size, **filtros) == 0:
+        return None
+    return pl.scan_parquet(parquet_file)
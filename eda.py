@@ -1,18 +1,47 @@
+import os
+import json
+import warnings
+import sqlite3
+import tempfile
 import mlxtend.preprocessing.shuffle
 import polars as pl
 import matplotlib.pyplot as plt
 import seaborn as sns
 import mondongo
+import dbSQL
+import snapshots
+import instrumentation
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from concurrent.futures import ThreadPoolExecutor
+from pymongoarrow.api import Schema, find_arrow_all
+
+@instrumentation.stage
+def get_dataframe(use_cache=False, refresh=False):
+    """
+    Obtiene la coleccion de MongoDB y la convierte en un DataFrame de Polars.
+    Con use_cache=True se reutiliza una snapshot local (Arrow IPC) mientras
+    la huella de los datos en MongoDB no cambie; refresh=True la regenera.
+    """
+    key = None
+    if use_cache:
+        try:
+            key = snapshots.snapshot_key(mondongo.COLLECTION_NAME, mondongo.get_source_fingerprint())
+            if not refresh:
+                df = snapshots.load_snapshot(key)
+                if df is not None:
+                    return df
+        except Exception as e:
+            print(f"Cache de snapshots no disponible: {e}")
+            key = None
 
-def get_dataframe():
-    """Obtiene la coleccion de MongoDB y la convierte en un DataFrame de Polars."""
     try:
         collection = mondongo.get_collection()
         print("Conectando a MongoDB para extraer datos...")
         
-        documents = list(collection.find())
+        documents = list(collection.find({}, {mondongo.HASH_FIELD: 0}))
         if not documents:
             print("No se encontraron datos en la coleccion.")
             return None
@@ -24,11 +53,124 @@ def get_dataframe():
 
         df = pl.from_dicts(documents)
         print(f"DataFrame creado con exito: {df.height} filas y {df.width} columnas.")
+        if key:
+            snapshots.save_snapshot(df, key)
         return df
     except Exception as e:
         print(f"Error al obtener el DataFrame: {e}")
         return None
 
+STAR_COLUMNS = [
+    "eventid",
+    "nkill", "nwound", "success", "propvalue", "iyear", "imonth", "iday",
+    "country_txt", "region_txt", "provstate", "city", "latitude", "longitude",
+    "gname", "gsubname", "attacktype1_txt", "suicide", "targtype1_txt",
+    "corp1", "target1", "weaptype1_txt", "weapsubtype1_txt"
+]
+CUBE_DIMENSIONS = ["iyear", "region_txt", "country_txt", "gname", "weaptype1_txt", "attacktype1_txt", "success"]
+CUBE_COUNT_COLUMN = "n_ataques"
+CUBE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "cubo_ataques.parquet")
+INT_COLUMNS = ["nkill", "nwound", "iyear", "imonth", "iday", "success"]
+FLOAT_COLUMNS = ["latitude", "longitude", "propvalue"]
+# Métricas opcionales de profile_data_quality (nulos y vacíos se calculan siempre)
+PROFILE_METRICS = ("cardinality", "range", "duplicates")
+# Máximo de valores distintos para tratar una columna entera como categórica (V de Cramér)
+CRAMER_MAX_LEVELS = 50
+
+def build_mongo_query(year_range=None, region=None):
+    """Traduce los filtros opcionales (rango de años, región) a una consulta de MongoDB."""
+    query = {}
+    if year_range is not None:
+        # En Mongo los campos se guardan como texto del CSV; con años de 4
+        # cifras la comparación lexicográfica equivale a la numérica.
+        start_year, end_year = year_range
+        query["iyear"] = {"$gte": str(start_year), "$lte": str(end_year)}
+    if region is not None:
+        regions = [region] if isinstance(region, str) else list(region)
+        query["region_txt"] = {"$in": regions}
+    return query
+
+@instrumentation.stage
+def get_dataframe_arrow(columns=None, year_range=None, region=None, lazy=False):
+    """
+    Extrae la colección proyectando solo las columnas pedidas y aplicando
+    los filtros en el propio MongoDB. Los lotes BSON se decodifican
+    directamente a Arrow (pymongoarrow), sin pasar por diccionarios Python.
+    Retorna un DataFrame (o LazyFrame si lazy=True) con esquema explícito.
+    """
+    columns = columns or STAR_COLUMNS
+    try:
+        collection = mondongo.get_collection()
+        print(f"Extrayendo {len(columns)} columnas de MongoDB en formato Arrow...")
+
+        schema = Schema({col: pa.string() for col in columns})
+        query = build_mongo_query(year_range, region)
+        table = find_arrow_all(collection, query, schema=schema)
+        if table.num_rows == 0:
+            print("No se encontraron datos en la coleccion.")
+            return None
+
+        df = pl.from_arrow(table)
+        print(f"DataFrame creado con exito: {df.height} filas y {df.width} columnas.")
+        return df.lazy() if lazy else df
+    except Exception as e:
+        print(f"Error al obtener el DataFrame: {e}")
+        return None
+
+def compute_partitions(collection, query, partition_by="eventid", num_partitions=4):
+    """
+    Divide la colección en rangos contiguos y equilibrados del campo indicado
+    usando $bucketAuto. Retorna una lista de consultas, una por partición.
+    """
+    buckets = list(collection.aggregate([
+        {"$match": query},
+        {"$bucketAuto": {"groupBy": f"${partition_by}", "buckets": num_partitions}},
+    ]))
+    partitions = []
+    for i, bucket in enumerate(buckets):
+        bounds = {"$gte": bucket["_id"]["min"]}
+        # El max de cada bucket es el min del siguiente; solo el último es inclusivo
+        if i == len(buckets) - 1:
+            bounds["$lte"] = bucket["_id"]["max"]
+        else:
+            bounds["$lt"] = bucket["_id"]["max"]
+        partitions.append({"$and": [query, {partition_by: bounds}]})
+    return partitions
+
+@instrumentation.stage
+def get_dataframe_parallel(columns=None, year_range=None, region=None, partition_by="eventid",
+                           num_partitions=None, max_workers=None, lazy=False):
+    """
+    Versión paralela de get_dataframe_arrow: reparte la colección en rangos
+    de eventid o iyear y los descarga concurrentemente sobre el pool de
+    conexiones de un único cliente. Las particiones se concatenan sin copiar.
+    """
+    columns = columns or STAR_COLUMNS
+    num_partitions = num_partitions or os.cpu_count() or 4
+    max_workers = max_workers or num_partitions
+    try:
+        collection = mondongo.get_collection()
+        schema = Schema({col: pa.string() for col in columns})
+        query = build_mongo_query(year_range, region)
+
+        partitions = compute_partitions(collection, query, partition_by, num_partitions)
+        if not partitions:
+            print("No se encontraron datos en la coleccion.")
+            return None
+        print(f"Extrayendo {len(partitions)} particiones por '{partition_by}' con {max_workers} hilos...")
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            tables = list(executor.map(lambda q: find_arrow_all(collection, q, schema=schema), partitions))
+
+        frames = [pl.from_arrow(table) for table in tables if table.num_rows > 0]
+        df = pl.concat(frames, rechunk=False)
+        print(f"DataFrame creado con exito: {df.height} filas y {df.width} columnas.")
+        return df.lazy() if lazy else df
+    except Exception as e:
+        print(f"Error al obtener el DataFrame: {e}")
+        return None
+
+@instrumentation.stage
 def select_star_schema_variables(df):
     
     print("Seleccionando variables para el modelo")
@@ -101,38 +243,92 @@ def save_quality_chart(report_df, title="Top 10 Variables con mas Nulos/Vacios")
     plt.tight_layout()
     plt.show()
 
+@instrumentation.stage
+def profile_data_quality(source, key_col="eventid", approx=False, streaming=None, metrics=PROFILE_METRICS):
+    """
+    Perfila todas las columnas en un único plan lazy. Los nulos y vacíos se
+    calculan siempre; `metrics` elige el resto: "cardinality" (exacta o
+    aproximada con HyperLogLog), "range" (mínimo y máximo, sin contar los
+    textos vacíos) y "duplicates" de la clave. `source` puede ser un
+    DataFrame, un LazyFrame o la ruta de una snapshot Parquet; las rutas se
+    escanean en modo streaming salvo streaming=False.
+    Retorna (report_df, total_filas, duplicados); duplicados es None si no se piden.
+    """
+    unknown = set(metrics) - set(PROFILE_METRICS)
+    if unknown:
+        raise ValueError(f"Métricas no soportadas: {unknown}")
+    if isinstance(source, str):
+        lf = pl.scan_parquet(source)
+        streaming = True if streaming is None else streaming
+    else:
+        lf = source.lazy()
+    schema = lf.collect_schema()
+
+    exprs = [pl.len().alias("__rows")]
+    if "duplicates" in metrics and key_col in schema:
+        exprs.append((pl.len() - pl.col(key_col).n_unique()).alias("__duplicates"))
+    for col, dtype in schema.items():
+        c = pl.col(col)
+        exprs.append(c.null_count().alias(f"{col}__nulos"))
+        if dtype == pl.String:
+            exprs.append((c == "").sum().alias(f"{col}__vacios"))
+        else:
+            exprs.append(pl.lit(0, dtype=pl.UInt32).alias(f"{col}__vacios"))
+        if "cardinality" in metrics:
+            unique_expr = c.approx_n_unique() if approx else c.n_unique()
+            exprs.append(unique_expr.alias(f"{col}__unicos"))
+        if "range" in metrics:
+            if dtype == pl.Null or dtype.is_nested():
+                exprs.append(pl.lit(None, dtype=pl.String).alias(f"{col}__min"))
+                exprs.append(pl.lit(None, dtype=pl.String).alias(f"{col}__max"))
+            else:
+                # Los vacíos se cuentan como faltantes, no como valor mínimo
+                values = c.filter(c != "") if dtype == pl.String else c
+                exprs.append(values.min().cast(pl.String).alias(f"{col}__min"))
+                exprs.append(values.max().cast(pl.String).alias(f"{col}__max"))
+
+    stats = lf.select(exprs).collect(engine="streaming" if streaming else "auto").row(0, named=True)
+
+    total_rows = stats["__rows"]
+    report = []
+    for col, dtype in schema.items():
+        n_null = stats[f"{col}__nulos"]
+        n_empty = stats[f"{col}__vacios"] or 0
+        total_missing = n_null + n_empty
+        row = {
+            "Variable": col,
+            "Tipo": str(dtype),
+            "Nulos": n_null,
+            "Vacios": n_empty,
+            "Total_Missing": total_missing,
+            "Percentage": (total_missing / total_rows) * 100 if total_rows else 0.0,
+        }
+        if "cardinality" in metrics:
+            row["Cardinalidad"] = stats[f"{col}__unicos"]
+        if "range" in metrics:
+            row["Min"] = stats[f"{col}__min"]
+            row["Max"] = stats[f"{col}__max"]
+        report.append(row)
+
+    report_df = pl.DataFrame(report).sort("Total_Missing", descending=True)
+    duplicates = stats.get("__duplicates", 0) if "duplicates" in metrics else None
+    return report_df, total_rows, duplicates
+
+@instrumentation.stage
 def analyze_data_quality(df):
 
     print("Analizando calidad del dato (Nulos y Vacios)...")
 
-    total_rows = df.height
-    missing_stats = []
-    
-    for col_name in df.columns:
-        n_null = df[col_name].null_count()
-        
-        n_empty = 0
-        if df[col_name].dtype in [pl.Utf8, pl.String]:
-            n_empty = (df[col_name] == "").sum()
-        
-        total_missing = n_null + n_empty
-        if total_missing > 0:
-            percentage = (total_missing / total_rows) * 100
-            missing_stats.append({
-                "Variable": col_name,
-                "Nulos": n_null,
-                "Vacios": n_empty,
-                "Total_Missing": total_missing,
-                "Percentage": percentage
-            })
-    
-    if not missing_stats:
+    profile_df, _, _ = profile_data_quality(df, metrics=())
+    report_df = profile_df.filter(pl.col("Total_Missing") > 0).select(
+        ["Variable", "Nulos", "Vacios", "Total_Missing", "Percentage"]
+    )
+
+    if report_df.is_empty():
         print("Excelente: No se han detectado valores nulos ni vacios.")
         return []
     
-    report_df = pl.DataFrame(missing_stats).sort("Total_Missing", descending=True)
-    
-    print(f"\nSe han detectado {len(missing_stats)} columnas con datos faltantes.")
+    print(f"\nSe han detectado {report_df.height} columnas con datos faltantes.")
     print("Top 100 variables con mas nulos/vacios:")
     top_100 = report_df.head(100)
     for row in top_100.rows(named=True):
@@ -143,6 +339,7 @@ def analyze_data_quality(df):
 
     return report_df["Variable"].to_list()
 
+@instrumentation.stage
 def check_duplicates(df, key_col="eventid"):
     
     print("Analizando duplicados...")
@@ -154,30 +351,31 @@ def check_duplicates(df, key_col="eventid"):
         return duplicates
     return 0
 
+def numeric_cast_exprs(available, int_cols=INT_COLUMNS, float_cols=FLOAT_COLUMNS):
+    """Expresiones de casteo numérico compartidas por los pipelines eager y lazy."""
+    exprs = [
+        pl.col(c).cast(pl.Float64, strict=False).fill_null(0).cast(pl.Int64)
+        for c in int_cols if c in available
+    ]
+    exprs += [
+        pl.col(c).cast(pl.Float64, strict=False).fill_null(0.0)
+        for c in float_cols if c in available
+    ]
+    return exprs
+
+@instrumentation.stage
 def cast_numeric_columns(df):
     print("Corrigiendo tipos de datos numéricos...")
     
-    # Columnas para convertir a Entero
+    # Enteros (incluye propvalue) y decimales, en una sola pasada
     cols_int = ["nkill", "nwound", "propvalue", "iyear", "imonth", "iday", "success"]
+    cols_float = ["latitude", "longitude"]
+    df = df.with_columns(numeric_cast_exprs(df.columns, cols_int, cols_float))
     for col in cols_int:
         if col in df.columns:
-            df = df.with_columns(
-                pl.col(col)
-                .cast(pl.Float64, strict=False) 
-                .fill_null(0)
-                .cast(pl.Int64)
-            )
             print(f" - Columna '{col}' convertida a Int64.")
-
-    # Columnas para convertir a Decimal (Float64)
-    cols_float = ["latitude", "longitude"]
     for col in cols_float:
         if col in df.columns:
-            df = df.with_columns(
-                pl.col(col)
-                .cast(pl.Float64, strict=False) 
-                .fill_null(0.0)
-            )
             print(f" - Columna '{col}' convertida a Float64.")
             
     return df
@@ -208,33 +406,93 @@ def list_categorical_uniques(df):
             
     return uniques_map
 
-def encode_categorical_columns(df):
+class CategoricalEncoder:
+    """
+    Codificador de columnas de texto basado en el tipo Enum de Polars.
+    `fit` aprende un vocabulario ordenado por columna (códigos estables
+    entre ejecuciones) y `transform` es un cast vectorizado a los códigos
+    físicos del Enum. Los valores no vistos se convierten en nulo, o
+    lanzan un error con handle_unknown="error".
+    """
+
+    def __init__(self, columns=None, handle_unknown="null"):
+        self.columns = columns
+        self.handle_unknown = handle_unknown
+        self.vocabularies = {}
+
+    def fit(self, df):
+        cols = self.columns or [col for col in df.columns if df[col].dtype in [pl.String, pl.Utf8]]
+        # Un único plan para todas las columnas; se excluyen nulos y vacíos
+        uniques = df.lazy().select([
+            pl.col(col).filter(pl.col(col) != "").unique().sort().implode()
+            for col in cols
+        ]).collect()
+        self.vocabularies = {col: uniques[col][0].to_list() for col in cols}
+        return self
+
+    def transform(self, df):
+        strict = self.handle_unknown == "error"
+        return df.with_columns([
+            pl.when(pl.col(col) != "").then(pl.col(col))
+            .cast(pl.Enum(categories), strict=strict)
+            .to_physical()
+            .cast(pl.Int64)
+            .alias(col)
+            for col, categories in self.vocabularies.items()
+            if col in df.columns
+        ])
+
+    def fit_transform(self, df):
+        return self.fit(df).transform(df)
+
+    def inverse_transform(self, df, unknown="Unknown"):
+        return df.with_columns([
+            pl.col(col).replace_strict(
+                list(range(len(categories))), categories, default=unknown, return_dtype=pl.String
+            ).alias(col)
+            for col, categories in self.vocabularies.items()
+            if col in df.columns
+        ])
+
+    @property
+    def mappings(self):
+        """Mapeos {columna: {texto: código}}, compatibles con show_specific_mapping."""
+        return {
+            col: {val: i for i, val in enumerate(categories)}
+            for col, categories in self.vocabularies.items()
+        }
+
+    def save(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"handle_unknown": self.handle_unknown, "vocabularies": self.vocabularies}, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        encoder = cls(columns=list(data["vocabularies"]), handle_unknown=data["handle_unknown"])
+        encoder.vocabularies = data["vocabularies"]
+        return encoder
+
+@instrumentation.stage
+def encode_categorical_columns(df, encoder=None):
     """
     Identifica automáticamente las columnas de tipo texto y las convierte
-    a numérico conservando el mapeo.
+    a numérico conservando el mapeo. Si se pasa un encoder ya ajustado,
+    se reutiliza su vocabulario (por ejemplo, para lotes nuevos).
     Retorna (df_transformado, dict_mapeos).
     """
-    # Identificamos columnas de tipo String/Utf8
-    cat_cols = [col for col in df.columns if df[col].dtype in [pl.String, pl.Utf8]]
+    if encoder is None:
+        encoder = CategoricalEncoder().fit(df)
     
-    print(f"Codificando columnas detectadas como texto: {cat_cols}...")
-    mappings = {}
-    
-    for col in cat_cols:
-        # Obtenemos valores únicos y creamos diccionario {texto: numero}
-        unique_vals = df[col].unique().to_list()
-        # Filtramos None o vacíos para que el mapeo sea limpio
-        mapping = {val: i for i, val in enumerate(unique_vals) if val not in [None, ""]}
-        mappings[col] = mapping
-        
-        # Aplicamos el mapeo usando una expresión de Polars
-        df = df.with_columns(
-            pl.col(col).replace(mapping, default=None).cast(pl.Int64)
-        )
-        print(f" - '{col}' codificado ({len(unique_vals)} categorías).")
+    print(f"Codificando columnas detectadas como texto: {list(encoder.vocabularies)}...")
+    df = encoder.transform(df)
+    for col, categories in encoder.vocabularies.items():
+        print(f" - '{col}' codificado ({len(categories)} categorías).")
             
-    return df, mappings
+    return df, encoder.mappings
 
+@instrumentation.stage
 def decode_categorical_columns(df, mappings):
     """
     Realiza el proceso inverso: de numérico a los textos originales usando los mapeos.
@@ -249,37 +507,81 @@ def decode_categorical_columns(df, mappings):
             )
     return df
 
-def run_lazy_pipeline(df):
-    
-    print("Iniciando Pipeline Lazy (Optimización de Polars)...")
-    
-    lf = df.lazy()
-    
-    star_columns = [
-        "eventid", 
-        "nkill", "nwound", "success", "propvalue", "iyear", "imonth", "iday", 
-        "country_txt", "region_txt", "provstate", "city", "latitude", "longitude", 
-        "gname", "gsubname", "attacktype1_txt", "suicide", "targtype1_txt", 
-        "corp1", "target1", "weaptype1_txt", "weapsubtype1_txt"
-    ]
-    available = [c for c in star_columns if c in df.columns]
+def build_lazy_pipeline(lf, add_fecha=False):
+    """
+    Construye el plan de limpieza sobre un LazyFrame: proyección del
+    modelo estrella, casteos, fecha opcional y filtro de fechas completas.
+    """
+    available = [c for c in STAR_COLUMNS if c in lf.collect_schema().names()]
 
     lf = (
         lf.select(available)
-        .with_columns([
-            pl.col(c).cast(pl.Float64, strict=False).fill_null(0).cast(pl.Int64) 
-            for c in ["nkill", "nwound", "iyear", "imonth", "iday", "success"] 
-            if c in available
-        ])
-        .with_columns([
-            pl.col(c).cast(pl.Float64, strict=False).fill_null(0.0)
-            for c in ["latitude", "longitude", "propvalue"]
-            if c in available
-        ])
+        .with_columns(numeric_cast_exprs(available))
         .filter(
             (pl.col("imonth") != 0) & (pl.col("iday") != 0)
         )
     )
+    if add_fecha:
+        lf = lf.with_columns(
+            pl.date(pl.col("iyear"), pl.col("imonth"), pl.col("iday")).cast(pl.String).alias("fecha")
+        )
+    return lf
+
+def transcode_to_utf8(path, encoding="latin-1", chunk_size=1 << 20):
+    """
+    Copia un CSV a UTF-8 junto al original ('<nombre>.utf8.csv') para que
+    scan_csv lo lea sin perder los acentos. La copia se reutiliza mientras
+    sea más reciente que el original.
+    """
+    target = f"{os.path.splitext(path)[0]}.utf8.csv"
+    if os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(path):
+        return target
+    print(f"Convirtiendo {path} de {encoding} a UTF-8...")
+    tmp_path = target + ".tmp"
+    with open(path, "r", encoding=encoding, newline="") as src, \
+            open(tmp_path, "w", encoding="utf-8", newline="") as dst:
+        while chunk := src.read(chunk_size):
+            dst.write(chunk)
+    os.replace(tmp_path, target)
+    return target
+
+def scan_source(source, encoding="latin-1"):
+    """
+    Devuelve un LazyFrame a partir de una snapshot Parquet/IPC, un CSV,
+    el lector de MongoDB ("mongo") o un DataFrame/LazyFrame ya existente.
+    Lanza ValueError si el origen no está soportado o está vacío.
+    """
+    if isinstance(source, pl.LazyFrame):
+        return source
+    if isinstance(source, pl.DataFrame):
+        if source.height == 0:
+            raise ValueError("El DataFrame de origen está vacío.")
+        return source.lazy()
+    if not isinstance(source, str):
+        raise ValueError(f"Origen no soportado: {type(source).__name__}")
+    if source == "mongo":
+        lf = get_dataframe_arrow(lazy=True)
+        if lf is None:
+            raise ValueError("No se pudieron extraer datos de MongoDB (colección vacía o inaccesible).")
+        return lf
+    if source.endswith(".parquet"):
+        return pl.scan_parquet(source)
+    if source.endswith((".arrow", ".ipc")):
+        return pl.scan_ipc(source)
+    if source.endswith(".csv"):
+        # El CSV del GTD es latin-1 y scan_csv solo lee utf8: se convierte
+        # antes a UTF-8. Todo se lee como texto (los casteos van después)
+        if encoding.lower().replace("-", "") not in ("utf8", "utf8lossy"):
+            source = transcode_to_utf8(source, encoding)
+        return pl.scan_csv(source, infer_schema=False)
+    raise ValueError(f"Origen no soportado: {source}")
+
+@instrumentation.stage
+def run_lazy_pipeline(df):
+    
+    print("Iniciando Pipeline Lazy (Optimización de Polars)...")
+    
+    lf = build_lazy_pipeline(df.lazy())
     
     print("Ejecutando plan optimizado con .collect()...")
     df_final = lf.collect()
@@ -287,6 +589,58 @@ def run_lazy_pipeline(df):
     print(f"Procesamiento Lazy finalizado: {df_final.height} registros válidos conservados.")
     return df_final
 
+@instrumentation.stage
+def run_streaming_pipeline(source, sink=None, table_name="INCIDENTES_LIMPIOS", streaming=True, batch_size=50000):
+    """
+    Pipeline de extremo a extremo sin materializar el frame ancho:
+    escanea el origen, aplica proyección/casteos/fecha/filtro en un solo
+    plan y lo ejecuta con el motor streaming de Polars. Si `sink` es un
+    .parquet se escribe directamente con sink_parquet; si es un .db se
+    vuelca por lotes de `batch_size` filas en la tabla `table_name` de SQLite.
+    """
+    print(f"Iniciando pipeline streaming desde: {source if isinstance(source, str) else type(source).__name__}...")
+    lf = build_lazy_pipeline(scan_source(source), add_fecha=True)
+    engine = "streaming" if streaming else "auto"
+
+    if sink is None:
+        df_final = lf.collect(engine=engine)
+        print(f"Procesamiento finalizado: {df_final.height} registros válidos conservados.")
+        return df_final
+
+    if sink.endswith(".parquet"):
+        lf.sink_parquet(sink)
+        print(f"Resultado escrito en: {sink}")
+        return sink
+
+    if sink.endswith(".db"):
+        # El plan se vuelca en streaming a un Parquet temporal y se inserta
+        # en SQLite lote a lote, sin materializar el resultado completo
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tmp_path = os.path.join(tmp_dir, "resultado.parquet")
+            lf.sink_parquet(tmp_path)
+            parquet_file = pq.ParquetFile(tmp_path)
+            names = parquet_file.schema_arrow.names
+            columns = ", ".join(names)
+            placeholders = ", ".join("?" for _ in names)
+            total = 0
+            conn = sqlite3.connect(sink)
+            try:
+                conn.execute(f"DROP TABLE IF EXISTS {table_name}")
+                conn.execute(f"CREATE TABLE {table_name} ({columns})")
+                for batch in parquet_file.iter_batches(batch_size=batch_size):
+                    conn.executemany(
+                        f"INSERT INTO {table_name} ({columns}) VALUES ({placeholders})",
+                        zip(*(col.to_pylist() for col in batch.columns)),
+                    )
+                    total += batch.num_rows
+                conn.commit()
+            finally:
+                conn.close()
+        print(f"Resultado escrito en: {sink} (tabla {table_name}, {total} filas)")
+        return sink
+
+    raise ValueError(f"Destino no soportado: {sink}")
+
 def show_specific_mapping(mappings, column_name):
     """
     Imprime de forma legible el mapeo almacenado para una columna específica.
@@ -307,18 +661,53 @@ def show_specific_mapping(mappings, column_name):
         print(f" ID {idx:2} -> {text}")
     print("------------------------------------------\n")
 
+@instrumentation.stage
+def build_rollup_cube(df):
+    """
+    Agrega los incidentes una sola vez por año × región × país × grupo ×
+    arma × tipo de ataque × éxito. Los gráficos leen de este cubo en lugar
+    de reagrupar todos los incidentes.
+    """
+    print("Construyendo cubo de agregados...")
+    measures = [pl.len().alias(CUBE_COUNT_COLUMN)]
+    measures += [pl.col(c).sum() for c in ["nkill", "nwound"] if c in df.columns]
+    cube = df.group_by(CUBE_DIMENSIONS).agg(measures)
+    print(f"Cubo creado: {cube.height} celdas a partir de {df.height} incidentes.")
+    return cube
+
+def save_rollup_cube(cube, path=CUBE_FILE):
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    cube.write_parquet(path)
+    print(f"Cubo guardado en: {path}")
+
+def load_rollup_cube(source=CUBE_FILE):
+    """Carga el cubo desde su Parquet o, si se pasa un .db, desde el almacén SQLite."""
+    if source.endswith(".db"):
+        return dbSQL.extraer_cubo(source)
+    return pl.read_parquet(source)
+
+def aggregate_counts(df, by):
+    """Cuenta incidentes por `by`; si `df` es el cubo, suma los conteos ya agregados."""
+    if CUBE_COUNT_COLUMN in df.columns:
+        return df.group_by(by).agg(pl.col(CUBE_COUNT_COLUMN).sum().alias("count"))
+    return df.group_by(by).agg(pl.len().alias("count"))
+
 def plot_top_countries(df, top_n=15):
     """Visualiza los países con mayor número de incidentes divididos por éxito/fallo."""
     print(f"Graficando Top {top_n} países con estado de éxito...")
     
-    # 1. Obtenemos los nombres de los top N países
-    top_country_names = df.group_by("country_txt").count().sort("count", descending=True).head(top_n).select("country_txt")
+    # 1. Un único agregado por país y éxito (o lectura del cubo)
+    country_success = aggregate_counts(df, ["country_txt", "success"])
+    top_country_names = (
+        country_success.group_by("country_txt").agg(pl.col("count").sum())
+        .sort("count", descending=True).head(top_n).select("country_txt")
+    )
     
-    # 2. Filtramos y agrupamos por país y éxito
+    # 2. Nos quedamos con los top N países
     country_counts = (
-        df.filter(pl.col("country_txt").is_in(top_country_names["country_txt"]))
-        .group_by(["country_txt", "success"])
-        .count()
+        country_success.filter(pl.col("country_txt").is_in(top_country_names["country_txt"]))
         .to_pandas()
     )
     
@@ -349,8 +738,7 @@ def plot_attacks_by_weapon(df):
     
     # 1. Agrupar y calcular porcentajes
     weapon_counts = (
-        df.group_by("weaptype1_txt")
-        .count()
+        aggregate_counts(df, "weaptype1_txt")
         .sort("count", descending=True)
     )
     
@@ -395,8 +783,7 @@ def plot_historical_evolution(df):
     print("Graficando evolución histórica por éxito...")
     
     yearly_trend = (
-        df.group_by(["iyear", "success"])
-        .count()
+        aggregate_counts(df, ["iyear", "success"])
         .sort("iyear")
         .to_pandas()
     )
@@ -423,13 +810,15 @@ def plot_top_groups(df, top_n=10, exclude_unknown=True):
     if exclude_unknown:
         groups_base = groups_base.filter(pl.col("gname") != "Unknown")
         
-    top_groups = groups_base.group_by("gname").count().sort("count", descending=True).head(top_n).select("gname")
+    group_success = aggregate_counts(groups_base, ["gname", "success"])
+    top_groups = (
+        group_success.group_by("gname").agg(pl.col("count").sum())
+        .sort("count", descending=True).head(top_n).select("gname")
+    )
     
-    # 2. Agrupamos por grupo y éxito
+    # 2. Nos quedamos con los top N grupos
     plot_data = (
-        groups_base.filter(pl.col("gname").is_in(top_groups["gname"]))
-        .group_by(["gname", "success"])
-        .count()
+        group_success.filter(pl.col("gname").is_in(top_groups["gname"]))
         .to_pandas()
     )
     
@@ -453,45 +842,206 @@ def plot_top_groups(df, top_n=10, exclude_unknown=True):
     plt.tight_layout()
     plt.show()
 
-def show_correlation_analysis(df, threshold=0.6):
+def _sample_frame(df, columns, sample=None, seed=1234):
+    data = df.select(columns)
+    if sample is not None and data.height > sample:
+        data = data.sample(n=sample, seed=seed)
+    # NaN cuenta como dato faltante, igual que en pandas
+    return data.with_columns([pl.col(c).fill_nan(None) for c in columns if data.schema[c].is_float()])
+
+def _prepare_matrix(data, method="pearson"):
+    """
+    Matriz estandarizada (media 0, varianza 1) de las columnas. Sin nulos
+    retorna (X float32, None); con nulos retorna (X float64 con los nulos
+    a 0, M máscara float64 de valores observados) para el cálculo por pares.
+    """
+    if method == "spearman":
+        data = data.select([pl.col(c).rank("average") for c in data.columns])
+    # Copia propia y en orden de columnas: los bloques se toman por columnas
+    X = np.array(data.select(pl.all().cast(pl.Float64)).to_numpy(), dtype=np.float64, order="F")
+    observed = ~np.isnan(X)
+    with np.errstate(divide="ignore", invalid="ignore"), warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        X -= np.nanmean(X, axis=0)
+        std = np.nanstd(X, axis=0, ddof=1)
+        X /= np.where(std > 0, std, np.nan)
+    if observed.all():
+        return np.asarray(X, dtype=np.float32, order="F"), None
+    X[~observed] = 0.0
+    return X, np.asarray(observed, dtype=np.float64, order="F")
+
+def _pairwise_block(XA, MA, XB, MB):
+    """
+    Pearson por pares con observaciones completas entre dos bloques de
+    columnas: conteos, sumas y sumas de cuadrados solo sobre las filas en
+    las que ambas columnas tienen valor (como DataFrame.corr de pandas).
+    """
+    n = MA.T @ MB
+    sum_a, sum_b = XA.T @ MB, MA.T @ XB
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cov = XA.T @ XB - sum_a * sum_b / n
+        var_a = (XA ** 2).T @ MB - sum_a ** 2 / n
+        var_b = MA.T @ XB ** 2 - sum_b ** 2 / n
+        r = cov / np.sqrt(var_a * var_b)
+    r[n < 2] = np.nan
+    return np.clip(r, -1.0, 1.0)
+
+@instrumentation.stage
+def correlation_matrix(df, columns, method="pearson", sample=None, block_size=64, seed=1234):
+    """
+    Matriz de correlación (Pearson o Spearman) calculada por bloques sobre
+    NumPy, con muestreo opcional de filas para entradas grandes. Con nulos
+    cada par usa solo sus observaciones completas, como pandas; en Spearman
+    los pares con nulos se recalculan re-ordenando sobre esas filas.
+    """
+    data = _sample_frame(df, columns, sample, seed)
+    X, M = _prepare_matrix(data, method)
+    n, k = X.shape
+    corr = np.empty((k, k), dtype=np.float32)
+    for i in range(0, k, block_size):
+        for j in range(i, k, block_size):
+            if M is None:
+                block = X[:, i:i + block_size].T @ X[:, j:j + block_size] / (n - 1)
+            else:
+                block = _pairwise_block(X[:, i:i + block_size], M[:, i:i + block_size],
+                                        X[:, j:j + block_size], M[:, j:j + block_size])
+            corr[i:i + block_size, j:j + block_size] = block
+            corr[j:j + block_size, i:i + block_size] = block.T
+    if method == "spearman" and M is not None:
+        with_nulls = set(np.flatnonzero(M.min(axis=0) < 1))
+        for a in range(k):
+            for b in range(a + 1, k):
+                if a in with_nulls or b in with_nulls:
+                    pair = data.select([columns[a], columns[b]]).drop_nulls()
+                    value = pair.select(pl.corr(columns[a], columns[b], method="spearman")).item() \
+                        if pair.height > 1 else None
+                    corr[a, b] = corr[b, a] = np.nan if value is None else value
+    np.fill_diagonal(corr, 1.0)
+    return corr
+
+def categorical_candidates(df, columns, max_levels=CRAMER_MAX_LEVELS):
+    """
+    Columnas aptas para la V de Cramér: texto, Enum, categóricas o booleanas,
+    y enteras (códigos de CategoricalEncoder, flags) con como mucho
+    max_levels valores distintos. Las continuas (float, conteos con muchos
+    valores como nkill) quedan fuera.
+    """
+    discrete = [c for c in columns if df.schema[c] in (pl.String, pl.Boolean)
+                or isinstance(df.schema[c], (pl.Enum, pl.Categorical))]
+    integer = [c for c in columns if df.schema[c].is_integer()]
+    if integer:
+        levels = df.select([pl.col(c).n_unique() for c in integer]).row(0)
+        discrete += [c for c, n in zip(integer, levels) if n <= max_levels]
+    return [c for c in columns if c in discrete]
+
+def _bias_corrected_v(phi2, r, c, n):
+    """
+    V de Cramér con la corrección de sesgo de Bergsma (2013): sin ella, dos
+    columnas independientes con muchos niveles dan valores altos.
+    """
+    if n < 2:
+        return np.nan
+    phi2 = max(0.0, phi2 - (r - 1) * (c - 1) / (n - 1))
+    r_corr = r - (r - 1) ** 2 / (n - 1)
+    c_corr = c - (c - 1) ** 2 / (n - 1)
+    min_dim = min(r_corr, c_corr) - 1
+    return np.sqrt(phi2 / min_dim) if min_dim > 0 else np.nan
+
+@instrumentation.stage
+def cramers_v_matrix(df, columns, sample=None, seed=1234):
+    """
+    V de Cramér entre columnas categóricas codificadas. Usa
+    chi2 = n * (sum(n_ij^2 / (n_i * n_j)) - 1), que solo necesita las
+    celdas observadas (un group_by por par), sin tablas de contingencia densas,
+    con la corrección de sesgo de Bergsma. Lanza ValueError con columnas float: hay que discretizarlas antes.
+    """
+    continuous = [c for c in columns if df.schema[c].is_float()]
+    if continuous:
+        raise ValueError(f"La V de Cramér necesita columnas categóricas; {continuous} son continuas.")
+    data = df.select(columns).drop_nulls()
+    if sample is not None and data.height > sample:
+        data = data.sample(n=sample, seed=seed)
+    n = data.height
+    k = len(columns)
+    cardinality = data.select([pl.col(c).n_unique() for c in columns]).row(0)
+    result = np.eye(k, dtype=np.float32)
+    for i in range(k):
+        for j in range(i + 1, k):
+            a, b = columns[i], columns[j]
+            phi2 = (
+                data.group_by([a, b]).len()
+                .with_columns(
+                    pl.col("len").sum().over(a).alias("n_a"),
+                    pl.col("len").sum().over(b).alias("n_b"),
+                )
+                .select(((pl.col("len") ** 2) / (pl.col("n_a") * pl.col("n_b"))).sum() - 1)
+                .item()
+            )
+            value = _bias_corrected_v(phi2, cardinality[i], cardinality[j], n)
+            result[i, j] = result[j, i] = value
+    return result
+
+def top_correlated_pairs(corr, names, threshold=None, top_k=None):
+    """
+    Pares del triángulo superior con |r| >= threshold y/o los top_k de
+    mayor |r|, sin construir el DataFrame apilado de todos los pares.
+    Retorna una lista de (var1, var2, valor) ordenada de mayor a menor.
+    """
+    upper = np.triu(np.abs(np.nan_to_num(corr, nan=0.0)), k=1)
+    if threshold is not None:
+        rows, cols = np.nonzero(upper >= threshold)
+    else:
+        rows, cols = np.triu_indices_from(upper, k=1)
+    if top_k is not None and len(rows) > top_k:
+        best = np.argpartition(upper[rows, cols], -top_k)[-top_k:]
+        rows, cols = rows[best], cols[best]
+    pairs = [(names[r], names[c], float(corr[r, c])) for r, c in zip(rows, cols)]
+    return sorted(pairs, key=lambda pair: pair[2], reverse=True)
+
+@instrumentation.stage
+def show_correlation_analysis(df, threshold=0.6, method="pearson", sample=None, categorical_columns=None):
     """
     Calcula la matriz de correlación, muestra un heatmap triangular
     y lista las variables con una correlación mayor al umbral especificado.
+    method admite "pearson", "spearman" o "cramer" (categóricas codificadas).
+    Con "cramer" solo se usan las columnas categóricas: las indicadas en
+    categorical_columns (p. ej. las claves de los mapeos del encoder) o,
+    si no se indican, las que detecta categorical_candidates.
     """
     print(f"Iniciando análisis de correlación (Umbral > {threshold})...")
     
     # Seleccionamos numéricas y quitamos IDs
     exclude_list = ["eventid", "id_ataque", "id_tiempo", "id_ubicacion", "latitude", "longitude"]
-    numeric_cols = [
-        col for col in df.columns 
-        if df[col].dtype.is_numeric() and col not in exclude_list
-    ]
+    if method == "cramer":
+        candidates = [col for col in (categorical_columns or df.columns) if col not in exclude_list]
+        numeric_cols = categorical_candidates(df, candidates) if categorical_columns is None else candidates
+    else:
+        numeric_cols = [
+            col for col in df.columns
+            if df[col].dtype.is_numeric() and col not in exclude_list
+        ]
     
     if not numeric_cols:
-        print("No hay variables numéricas.")
+        print("No hay variables numéricas." if method != "cramer" else "No hay variables categóricas.")
         return
 
-    # Calculamos correlación con Pandas
-    corr_matrix = df.select(numeric_cols).to_pandas().corr()
+    # Calculamos la correlación con NumPy por bloques
+    if method == "cramer":
+        corr = cramers_v_matrix(df, numeric_cols, sample=sample)
+    else:
+        corr = correlation_matrix(df, numeric_cols, method=method, sample=sample)
+    corr_matrix = pd.DataFrame(corr, index=numeric_cols, columns=numeric_cols)
     
     # 1. Lista de correlaciones altas (evitando duplicados y la diagonal)
     print(f"\n--- Variables con Correlación >= {threshold} ---")
-    high_corr_found = False
     affected_vars = set()
     
-    # Obtenemos el triángulo superior
-    sol = (corr_matrix.where(np.triu(np.ones(corr_matrix.shape), k=1).astype(bool))
-                  .stack()
-                  .sort_values(ascending=False))
-    
-    for (val1, val2), value in sol.items():
-        if abs(value) >= threshold:
-            print(f" * {val1} <-> {val2}: {value:.4f}")
-            affected_vars.add(val1)
-            affected_vars.add(val2)
-            high_corr_found = True
+    for val1, val2, value in top_correlated_pairs(corr, numeric_cols, threshold=threshold):
+        print(f" * {val1} <-> {val2}: {value:.4f}")
+        affected_vars.add(val1)
+        affected_vars.add(val2)
             
-    if not high_corr_found:
+    if not affected_vars:
         print(f"No se han encontrado pares con correlación superior o igual a {threshold}.")
     else:
         print(f"\nLista de variables altamente correlacionadas: {list(affected_vars)}")
@@ -515,4 +1065,3 @@ def show_correlation_analysis(df, threshold=0.6):
     plt.show()
 
     return corr_matrix
-
@@ -0,0 +1,224 @@
+import os
+import gc
+import json
+import time
+import uuid
+import threading
+import functools
+import contextvars
+import psutil
+import polars as pl
+
+TRACE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "traces")
+# Trazas desactivadas por defecto: se activan con GTD_TRACE=1 (o GTD_TRACE_FILE) o con configure()
+TRACE_FILE = os.environ.get("GTD_TRACE_FILE") or os.path.join(TRACE_DIR, "stages.jsonl")
+SAMPLE_INTERVAL = 0.05
+ENABLED = os.environ.get("GTD_TRACE", "").lower() in ("1", "true", "yes") or "GTD_TRACE_FILE" in os.environ
+ECHO = False
+RUN_ID = uuid.uuid4().hex[:12]
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+_write_lock = threading.Lock()
+
+def configure(trace_file=None, enabled=None, echo=None, run_id=None):
+    """
+    Ajusta la instrumentación: fichero de trazas (JSON por línea), activarla
+    o desactivarla, imprimir cada etapa al terminar y el identificador de
+    ejecución con el que se agrupan las etapas. Indicar un fichero de trazas
+    activa la instrumentación salvo que se pase enabled=False.
+    """
+    global TRACE_FILE, ENABLED, ECHO, RUN_ID
+    if trace_file is not None:
+        TRACE_FILE = trace_file
+        ENABLED = True
+    if enabled is not None:
+        ENABLED = enabled
+    if echo is not None:
+        ECHO = echo
+    if run_id is not None:
+        RUN_ID = run_id
+    return RUN_ID
+
+def _rss():
+    return psutil.Process().memory_info().rss
+
+class PeakMemorySampler:
+    """Muestrea el RSS del proceso en un hilo para obtener el pico durante una etapa."""
+
+    def __init__(self, interval=SAMPLE_INTERVAL, collect=False):
+        self.interval = interval
+        self.collect = collect
+        self.baseline = 0
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, _rss())
+
+    def start(self):
+        if self.collect:
+            gc.collect()
+        self.baseline = self.peak = _rss()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, _rss())
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+class _SharedSampler:
+    """
+    Un único hilo muestrea el RSS mientras haya etapas en curso y actualiza
+    el pico de cada una, en lugar de un hilo por llamada decorada.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._peaks = {}
+        self._stop = None
+
+    def _run(self, stop):
+        while not stop.wait(self.interval):
+            rss = _rss()
+            with self._lock:
+                for key, peak in self._peaks.items():
+                    self._peaks[key] = max(peak, rss)
+
+    def enter(self, key):
+        """Registra una etapa y retorna su RSS de partida."""
+        rss = _rss()
+        with self._lock:
+            self._peaks[key] = rss
+            if self._stop is None:
+                self._stop = threading.Event()
+                threading.Thread(target=self._run, args=(self._stop,), daemon=True).start()
+        return rss
+
+    def exit(self, key):
+        """Da de baja una etapa y retorna su pico de RSS."""
+        rss = _rss()
+        with self._lock:
+            peak = max(self._peaks.pop(key), rss)
+            if not self._peaks:
+                self._stop.set()
+                self._stop = None
+        return peak
+
+_sampler = _SharedSampler()
+
+def frame_shape(obj):
+    """(filas, columnas) de un DataFrame de Polars/pandas, H2OFrame o Series; (None, None) si no aplica."""
+    if isinstance(obj, tuple) and obj:
+        obj = obj[0]
+    shape = getattr(obj, "shape", None)
+    if not isinstance(shape, tuple):
+        return None, None
+    if len(shape) == 1:
+        return int(shape[0]), 1
+    if len(shape) == 2:
+        return int(shape[0]), int(shape[1])
+    return None, None
+
+def _input_shape(args, kwargs):
+    for value in list(args) + list(kwargs.values()):
+        rows, cols = frame_shape(value)
+        if rows is not None:
+            return rows, cols
+    return None, None
+
+def emit(record):
+    """Añade un registro al fichero de trazas (una línea JSON por etapa)."""
+    try:
+        directory = os.path.dirname(TRACE_FILE)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        line = json.dumps(record, default=str, ensure_ascii=False)
+        with _write_lock:
+            with open(TRACE_FILE, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+    except Exception as e:
+        print(f"No se pudo escribir la traza: {e}")
+    if ECHO:
+        print(f"[traza] {record['stage']}: {record['wall_s']:.2f}s pared, {record['cpu_s']:.2f}s CPU, "
+              f"pico {record['peak_rss_mb']:.0f} MB, filas {record['rows_in']} -> {record['rows_out']}")
+
+def stage(func):
+    """
+    Decorador de etapa: registra tiempo de pared, tiempo de CPU del proceso,
+    pico de RSS y filas/columnas de entrada y salida. Las etapas anidadas
+    guardan la etapa padre para reconstruir la traza completa.
+    """
+    name = f"{func.__module__}.{func.__qualname__}"
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not ENABLED:
+            return func(*args, **kwargs)
+        parent_id = _current_span.get()
+        span_id = uuid.uuid4().hex[:16]
+        token = _current_span.set(span_id)
+        rows_in, cols_in = _input_shape(args, kwargs)
+        record = {
+            "run_id": RUN_ID, "span_id": span_id, "parent_id": parent_id, "stage": name,
+            "pid": os.getpid(), "thread": threading.current_thread().name,
+            "start": time.time(), "rows_in": rows_in, "cols_in": cols_in,
+        }
+        baseline = _sampler.enter(span_id)
+        cpu_start = time.process_time()
+        start = time.perf_counter()
+        result, error = None, None
+        try:
+            result = func(*args, **kwargs)
+            return result
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            record["wall_s"] = time.perf_counter() - start
+            record["cpu_s"] = time.process_time() - cpu_start
+            peak = _sampler.exit(span_id)
+            _current_span.reset(token)
+            record["peak_rss_mb"] = peak / 1024 ** 2
+            record["rss_delta_mb"] = (peak - baseline) / 1024 ** 2
+            record["rows_out"], record["cols_out"] = frame_shape(result)
+            record["status"] = "error" if error else "ok"
+            if error:
+                record["error"] = repr(error)
+            emit(record)
+
+    return wrapper
+
+def load_traces(trace_file=None, run_id=None):
+    """Lee el fichero de trazas como DataFrame de Polars, opcionalmente de una sola ejecución."""
+    df = pl.read_ndjson(trace_file or TRACE_FILE, infer_schema_length=None)
+    if run_id is not None:
+        df = df.filter(pl.col("run_id") == run_id)
+    return df
+
+def summarize(trace_file=None, run_id=None):
+    """Resumen por etapa: llamadas, tiempos de pared y CPU y pico de memoria."""
+    return (
+        load_traces(trace_file, run_id)
+        .group_by("stage")
+        .agg(
+            pl.len().alias("llamadas"),
+            pl.col("wall_s").sum().alias("pared_total_s"),
+            pl.col("wall_s").median().alias("pared_p50_s"),
+            pl.col("cpu_s").sum().alias("cpu_total_s"),
+            pl.col("peak_rss_mb").max().alias("pico_rss_mb"),
+            pl.col("rows_out").max().alias("filas_salida"),
+            (pl.col("status") == "error").sum().alias("errores"),
+        )
+        .sort("pared_total_s", descending=True)
+    )
@@ -1,16 +1,91 @@
+import os
+import time
 import h2o
+import polars as pl
+import matplotlib.pyplot as plt
+from concurrent.futures import ThreadPoolExecutor
 from h2o.frame import H2OFrame
 from h2o.estimators import H2ORandomForestEstimator, H2OGradientBoostingEstimator
 from h2o.estimators import H2OPrincipalComponentAnalysisEstimator
+from h2o.grid.grid_search import H2OGridSearch
+import model_cache
+import instrumentation
 
 CLASSIFICATION_VAR = "success"
 REGRESSION_VAR = "targtype1_txt"
+H2O_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "h2o")
 
-def init(df):
-    h2o.init()
-    hf = H2OFrame(df)
+CLASSIFIER_PARAMS = {"ntrees": 50, "max_depth": 20, "seed": 1234, "balance_classes": True}
+REGRESSOR_PARAMS = {"ntrees": 50, "max_depth": 20, "seed": 1234}
+GBM_PARAMS = {"ntrees": 200, "max_depth": 5, "learn_rate": 0.1, "seed": 1234}
+RF_HYPER_PARAMS = {
+    "ntrees": [50, 100, 200],
+    "max_depth": [10, 20, 30],
+    "min_rows": [1, 5, 10],
+    "sample_rate": [0.632, 0.8, 1.0],
+    "mtries": [-1, 3, 5],
+}
+GBM_HYPER_PARAMS = {
+    "ntrees": [100, 200, 400],
+    "max_depth": [3, 5, 7, 9],
+    "learn_rate": [0.01, 0.05, 0.1],
+    "sample_rate": [0.7, 0.9, 1.0],
+    "col_sample_rate": [0.7, 0.9, 1.0],
+}
+EARLY_STOPPING = {"stopping_rounds": 3, "stopping_metric": "AUTO", "stopping_tolerance": 1e-3, "score_tree_interval": 5}
+
+def infer_col_types(schema):
+    """Tipos de columna H2O declarados de antemano: factores para texto y el target de clasificación."""
+    col_types = {}
+    for col, dtype in schema.items():
+        if col == CLASSIFICATION_VAR or dtype in (pl.String, pl.Categorical, pl.Boolean) or isinstance(dtype, pl.Enum):
+            col_types[col] = "enum"
+        elif dtype.is_temporal():
+            col_types[col] = "time"
+        else:
+            col_types[col] = "numeric"
+    return col_types
+
+@instrumentation.stage
+def init(df, col_types=None, server_side=True, nthreads=-1):
+    """
+    Arranca H2O y carga los datos. Acepta un DataFrame de Polars o la ruta
+    de una snapshot Parquet, que se importa con el lector Parquet nativo
+    de H2O (sin copia en pandas ni CSV temporal) y con los tipos declarados.
+    Con server_side=False el Parquet se sube desde el cliente (clúster remoto).
+    Un DataFrame de pandas se sigue cargando con H2OFrame.
+    nthreads fija los hilos del clúster local (-1 = todos los núcleos).
+    """
+    h2o.init(nthreads=nthreads)
+    if not isinstance(df, (pl.DataFrame, pl.LazyFrame, str)):
+        return H2OFrame(df)
+
+    temp_file = None
+    if isinstance(df, str):
+        path = df
+        schema = pl.scan_parquet(path).collect_schema()
+    else:
+        os.makedirs(H2O_DATA_DIR, exist_ok=True)
+        temp_file = os.path.join(H2O_DATA_DIR, f"frame_{os.getpid()}_{int(time.time() * 1000)}.parquet")
+        if isinstance(df, pl.LazyFrame):
+            df.sink_parquet(temp_file)
+        else:
+            df.write_parquet(temp_file)
+        path = temp_file
+        schema = pl.scan_parquet(path).collect_schema()
+
+    col_types = col_types or infer_col_types(schema)
+    try:
+        print(f"Importando Parquet en H2O: {path}...")
+        loader = h2o.import_file if server_side else h2o.upload_file
+        hf = loader(os.path.abspath(path), col_types=col_types)
+    finally:
+        if temp_file and os.path.exists(temp_file):
+            os.remove(temp_file)
+    print(f"H2OFrame cargado: {hf.nrows} filas y {hf.ncols} columnas.")
     return hf
 
+@instrumentation.stage
 def split_data(hf):
     # Columnas predictoras
     predictors = [col for col in hf.columns if col not in [CLASSIFICATION_VAR, REGRESSION_VAR]]
@@ -25,18 +100,26 @@ def split_data(hf):
 
     return predictors, classification_target, regression_target, hf
 
+@instrumentation.stage
 def divide_data(hf):
     train, test = hf.split_frame(ratios=[0.8], seed=1234)
     return train, test
 
-def plot_model_results(model, perf):
-    """Genera visualizaciones clave del modelo."""
+def plot_model_results(model, perf, output_dir=None):
+    """
+    Genera visualizaciones clave del modelo. Con output_dir se guardan
+    como PNG (modo headless, sin plt.show) y se devuelven las rutas.
+    """
     print("\n--- Generando Visualizaciones de H2O ---")
+    server = output_dir is not None
+    saved = []
     
     # 1. Importancia de Variables (¿Qué es lo más relevante?)
     try:
         print("Graficando Importancia de Variables...")
-        model.varimp_plot()
+        model.varimp_plot(server=server)
+        if server:
+            saved.append(_save_current_figure(output_dir, f"{model.model_id}_varimp.png"))
     except:
         print("No se pudo generar el gráfico de importancia.")
 
@@ -44,23 +127,24 @@ def plot_model_results(model, perf):
     try:
         if hasattr(perf, "roc"):
             print("Graficando Curva ROC...")
-            perf.plot(type="roc")
+            perf.plot(type="roc", server=server)
+            if server:
+                saved.append(_save_current_figure(output_dir, f"{model.model_id}_roc.png"))
     except:
         pass
 
-def classify_h2o(train, test, predictors, classification_target):
-    # Crear y entrenar clasificacion
-    rf_clf = H2ORandomForestEstimator(
-        ntrees=50,
-        max_depth=20,
-        seed=1234,
-        balance_classes=True
-    )
+    return saved
 
-    rf_clf.train(x=predictors, y=classification_target, training_frame=train)
+def _save_current_figure(output_dir, filename):
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, filename)
+    plt.gcf().savefig(path, dpi=120, bbox_inches="tight")
+    plt.close("all")
+    return path
 
+def evaluate_classifier(model, test):
     # Evaluar test
-    perf_clf_test = rf_clf.model_performance(test_data=test)
+    perf_clf_test = model.model_performance(test_data=test)
 
     # Accuracy y F1
     accuracy_default = perf_clf_test.accuracy()[0][1]
@@ -73,51 +157,223 @@ def classify_h2o(train, test, predictors, classification_target):
     print("F1:", perf_clf_test.F1())
     print("Confusion Matrix:")
     print(perf_clf_test.confusion_matrix())
+
+    metrics = {"accuracy": accuracy_default, "accuracy_max_f1": accuracy_best, "auc": perf_clf_test.auc()}
+    return perf_clf_test, metrics
+
+def evaluate_regressor(model, test):
+    # Evaluar test
+    perf_reg_test = model.model_performance(test_data=test)
+
+    # Métricas detalladas
+    print(f"R^2: {perf_reg_test.r2():.4f}")
+    print(f"RMSE: {perf_reg_test.rmse():.4f}")
+    print(f"MAE: {perf_reg_test.mae():.4f}")
+
+    metrics = {"r2": perf_reg_test.r2(), "rmse": perf_reg_test.rmse(), "mae": perf_reg_test.mae()}
+    return perf_reg_test, metrics
+
+def evaluate_gbm(model, test):
+    perf = model.model_performance(test_data=test)
+
+    print("R²:", perf.r2())
+    print("MSE:", perf.mse())
+    print("RMSE:", perf.rmse())
+
+    metrics = {"r2": perf.r2(), "mse": perf.mse(), "rmse": perf.rmse()}
+    return perf, metrics
+
+@instrumentation.stage
+def classify_h2o(train, test, predictors, classification_target, use_cache=True, **params):
+    # Crear y entrenar clasificacion
+    rf_clf = H2ORandomForestEstimator(**{**CLASSIFIER_PARAMS, **params})
+
+    if use_cache:
+        rf_clf = model_cache.train_cached(rf_clf, predictors, classification_target, train)
+    else:
+        rf_clf.train(x=predictors, y=classification_target, training_frame=train)
+
+    perf_clf_test, _ = evaluate_classifier(rf_clf, test)
     
     # Llamamos a las visualizaciones
     plot_model_results(rf_clf, perf_clf_test)
     
     return rf_clf
 
-def regression_h2o(train, test, predictors, regression_target):
+@instrumentation.stage
+def regression_h2o(train, test, predictors, regression_target, use_cache=True, **params):
     # Crear y entrenar regresión
-    rf_reg = H2ORandomForestEstimator(
-        ntrees=50,
-        max_depth=20,
-        seed=1234
-    )
+    rf_reg = H2ORandomForestEstimator(**{**REGRESSOR_PARAMS, **params})
 
-    rf_reg.train(x=predictors, y=regression_target, training_frame=train)
+    if use_cache:
+        rf_reg = model_cache.train_cached(rf_reg, predictors, regression_target, train)
+    else:
+        rf_reg.train(x=predictors, y=regression_target, training_frame=train)
 
-    # Evaluar test
-    perf_reg_test = rf_reg.model_performance(test_data=test)
-
-    # Métricas detalladas
-    print(f"R^2: {perf_reg_test.r2():.4f}")
-    print(f"RMSE: {perf_reg_test.rmse():.4f}")
-    print(f"MAE: {perf_reg_test.mae():.4f}")
+    perf_reg_test, _ = evaluate_regressor(rf_reg, test)
     
     # Llamamos a las visualizaciones
     plot_model_results(rf_reg, perf_reg_test)
     
     return rf_reg
 
-def gradientBoost_h2o(train, test, predictors, regression_target):
-    gbm = H2OGradientBoostingEstimator(
-        ntrees=200,
-        max_depth=5,
-        learn_rate=0.1,
-        seed=1234
-    )
-
-    gbm.train(x=predictors, y=regression_target, training_frame=train)
-    perf = gbm.model_performance(test_data=test)
+@instrumentation.stage
+def gradientBoost_h2o(train, test, predictors, regression_target, use_cache=True, **params):
+    gbm = H2OGradientBoostingEstimator(**{**GBM_PARAMS, **params})
 
-    print("R²:", perf.r2())
-    print("MSE:", perf.mse())
-    print("RMSE:", perf.rmse())
+    if use_cache:
+        gbm = model_cache.train_cached(gbm, predictors, regression_target, train)
+    else:
+        gbm.train(x=predictors, y=regression_target, training_frame=train)
+    perf, _ = evaluate_gbm(gbm, test)
     
     # Llamamos a las visualizaciones
     plot_model_results(gbm, perf)
     
-    return gbm
\ No newline at end of file
+    return gbm
+
+def default_jobs(classification_target, regression_target):
+    """Los tres modelos del proyecto como trabajos para train_concurrently."""
+    return [
+        {"name": "rf_clasificacion", "estimator": H2ORandomForestEstimator, "params": CLASSIFIER_PARAMS,
+         "target": classification_target, "evaluate": evaluate_classifier},
+        {"name": "rf_regresion", "estimator": H2ORandomForestEstimator, "params": REGRESSOR_PARAMS,
+         "target": regression_target, "evaluate": evaluate_regressor},
+        {"name": "gbm", "estimator": H2OGradientBoostingEstimator, "params": GBM_PARAMS,
+         "target": regression_target, "evaluate": evaluate_gbm},
+    ]
+
+@instrumentation.stage
+def train_concurrently(train, test, predictors, classification_target, regression_target, jobs=None,
+                       max_parallel=None, early_stopping=True, max_runtime_secs=None, validation=None, evaluate=True,
+                       use_cache=True):
+    """
+    Lanza el entrenamiento de varios modelos a la vez sobre el clúster H2O
+    (un hilo cliente por trabajo) con parada temprana opcional, y registra
+    el tiempo de pared y el throughput de cada modelo.
+
+    - max_parallel: trabajos simultáneos (por defecto, todos). Es la forma
+      de repartir la CPU: H2O comparte su pool de hilos entre los trabajos
+      activos y el total se fija con init(nthreads=...).
+    - early_stopping: True usa EARLY_STOPPING; un dict lo sobrescribe.
+    - max_runtime_secs: límite de tiempo por modelo.
+    - validation: frame para la parada temprana; sin él se usan las
+      métricas de entrenamiento (OOB en random forest), no el test.
+    - use_cache: recarga de model_cache los modelos ya entrenados con los
+      mismos datos y parámetros.
+    Retorna (modelos, tiempos, métricas).
+    """
+    jobs = jobs or default_jobs(classification_target, regression_target)
+    stopping = {}
+    if early_stopping:
+        stopping = dict(EARLY_STOPPING) if early_stopping is True else dict(early_stopping)
+    if max_runtime_secs:
+        stopping["max_runtime_secs"] = max_runtime_secs
+
+    n_rows = train.nrows
+    start = time.perf_counter()
+
+    def run(job):
+        model = job["estimator"](**{**job["params"], **stopping, **job.get("overrides", {})})
+        job_start = time.perf_counter()
+        if use_cache:
+            model = model_cache.train_cached(model, predictors, job["target"], train, validation)
+        else:
+            model.train(x=predictors, y=job["target"], training_frame=train, validation_frame=validation)
+        job_end = time.perf_counter()
+        return job["name"], model, {
+            "start": job_start - start,
+            "seconds": job_end - job_start,
+            "rows_per_sec": n_rows / (job_end - job_start),
+        }
+
+    print(f"Entrenando {len(jobs)} modelos en paralelo...")
+    models, timings = {}, {}
+    with ThreadPoolExecutor(max_workers=max_parallel or len(jobs)) as executor:
+        for name, model, timing in executor.map(run, jobs):
+            models[name] = model
+            timings[name] = timing
+
+    total = time.perf_counter() - start
+    print(f"Entrenamiento completado en {total:.1f}s (suma secuencial: {sum(t['seconds'] for t in timings.values()):.1f}s).")
+    for name, timing in timings.items():
+        print(f" - {name}: {timing['seconds']:.1f}s ({timing['rows_per_sec']:,.0f} filas/s)")
+
+    metrics = {}
+    if evaluate:
+        for job in jobs:
+            print(f"\n--- {job['name']} ---")
+            _, metrics[job["name"]] = job["evaluate"](models[job["name"]], test)
+    return models, timings, metrics
+
+def _model_footprint(model):
+    """Tiempo de entrenamiento (s) y tamaño del modelo (bytes) según el resumen de H2O."""
+    output = model._model_json["output"]
+    seconds = output.get("run_time", 0) / 1000
+    try:
+        size = output["model_summary"]["model_size_in_bytes"][0]
+    except Exception:
+        size = None
+    return seconds, size
+
+@instrumentation.stage
+def hyperparameter_search(train, predictors, target, algorithm="rf", hyper_params=None, max_runtime_secs=600,
+                          max_models=30, nfolds=5, parallelism=0, test=None, seed=1234):
+    """
+    Búsqueda aleatoria de hiperparámetros con presupuesto global de tiempo y
+    de modelos, validación cruzada, construcción de modelos en paralelo
+    (parallelism=0 deja que H2O elija) y parada temprana por modelo.
+    Retorna (grid, leaderboard) con las métricas junto al tiempo de
+    entrenamiento y el tamaño de cada modelo.
+    """
+    is_classification = train[target].isfactor()[0]
+    if algorithm == "rf":
+        estimator = H2ORandomForestEstimator
+        base_params = dict(CLASSIFIER_PARAMS if is_classification else REGRESSOR_PARAMS)
+        hyper_params = hyper_params or RF_HYPER_PARAMS
+    else:
+        estimator, base_params = H2OGradientBoostingEstimator, dict(GBM_PARAMS)
+        hyper_params = hyper_params or GBM_HYPER_PARAMS
+    # Los hiperparámetros buscados no se fijan en el estimador base
+    base_params = {k: v for k, v in base_params.items() if k not in hyper_params}
+    base_params.update(EARLY_STOPPING)
+    if nfolds:
+        base_params.update({"nfolds": nfolds, "fold_assignment": "Modulo", "keep_cross_validation_predictions": False})
+
+    search_criteria = {
+        "strategy": "RandomDiscrete",
+        "max_runtime_secs": max_runtime_secs,
+        "max_models": max_models,
+        "seed": seed,
+    }
+    grid = H2OGridSearch(
+        model=estimator(**base_params),
+        hyper_params=hyper_params,
+        search_criteria=search_criteria,
+        parallelism=parallelism,
+    )
+
+    print(f"Búsqueda de hiperparámetros ({algorithm}): hasta {max_models} modelos o {max_runtime_secs}s...")
+    start = time.perf_counter()
+    grid.train(x=predictors, y=target, training_frame=train)
+    print(f"Búsqueda completada en {time.perf_counter() - start:.1f}s: {len(grid.models)} modelos.")
+
+    rows = []
+    for m in grid.models:
+        seconds, size = _model_footprint(m)
+        row = {"model_id": m.model_id}
+        row.update({name: m.actual_params.get(name) for name in hyper_params})
+        xval = bool(nfolds) and test is None
+        perf = m.model_performance(test_data=test) if test is not None else None
+        if is_classification:
+            row["auc"] = perf.auc() if perf else m.auc(xval=xval)
+            row["accuracy"] = (perf or m.model_performance(xval=xval)).accuracy()[0][1]
+        row["rmse"] = perf.rmse() if perf else m.rmse(xval=xval)
+        row["training_seconds"] = seconds
+        row["model_size_bytes"] = size
+        rows.append(row)
+
+    sort_by = "auc" if is_classification else "rmse"
+    leaderboard = pl.DataFrame(rows).sort(sort_by, descending=is_classification)
+    print(leaderboard)
+    return grid, leaderboard
@@ -0,0 +1,117 @@
+import os
+import glob
+import json
+import hashlib
+import h2o
+
+MODEL_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "models")
+MODEL_CACHE_MAX_BYTES = 2 * 1024 ** 3
+MOJO_SUFFIX = ".mojo.zip"
+
+# Parámetros del estimador que dependen de la sesión y no del modelo
+VOLATILE_PARAMS = {"model_id", "training_frame", "validation_frame", "response_column", "ignored_columns", "x", "y"}
+
+def frame_fingerprint(frame):
+    """
+    Huella de un H2OFrame: esquema (nombres y tipos), número de filas y el
+    checksum de contenido que H2O calcula en el servidor, sin descargar datos.
+    """
+    try:
+        info = h2o.api(f"GET /3/Frames/{frame.frame_id}", data={"row_count": 0})["frames"][0]
+        checksum = info.get("checksum")
+    except Exception as e:
+        print(f"No se pudo leer el checksum del frame, se usa su id: {e}")
+        checksum = frame.frame_id
+    schema = sorted(frame.types.items())
+    return f"{schema}|{frame.nrows}|{checksum}"
+
+def model_key(estimator, frame, predictors, target, validation=None):
+    """Clave del modelo: algoritmo + versión de H2O + huella de los datos + parámetros."""
+    params = {k: v for k, v in estimator._parms.items() if k not in VOLATILE_PARAMS}
+    payload = json.dumps({
+        "algo": estimator.algo,
+        "h2o": h2o.__version__,
+        "train": frame_fingerprint(frame),
+        "valid": frame_fingerprint(validation) if validation is not None else None,
+        "x": sorted(predictors),
+        "y": target,
+        "params": params,
+    }, sort_keys=True, default=str)
+    digest = hashlib.blake2b(payload.encode("utf-8"), digest_size=12).hexdigest()
+    return f"{estimator.algo}-{digest}"
+
+def model_path(key):
+    return os.path.join(MODEL_CACHE_DIR, key)
+
+def load_cached_model(key):
+    """Recarga el modelo binario si existe en cache; None si no está o está corrupto."""
+    path = model_path(key)
+    if not os.path.exists(path):
+        return None
+    try:
+        model = h2o.load_model(path)
+        # Actualizamos mtime (binario y MOJO) para que la expulsión sea LRU
+        for f in glob.glob(path + "*"):
+            os.utime(f)
+        print(f"Modelo cargado desde cache: {path}")
+        return model
+    except Exception as e:
+        print(f"Modelo en cache inservible, se descarta: {e}")
+        remove_model(key)
+        return None
+
+def save_cached_model(model, key, max_bytes=MODEL_CACHE_MAX_BYTES):
+    """Guarda el modelo como binario H2O (para recargarlo) y como MOJO (para puntuar sin clúster)."""
+    if not os.path.exists(MODEL_CACHE_DIR):
+        os.makedirs(MODEL_CACHE_DIR)
+    path = h2o.save_model(model, path=MODEL_CACHE_DIR, filename=key, force=True)
+    try:
+        mojo_path = model.save_mojo(path=MODEL_CACHE_DIR, force=True)
+        os.replace(mojo_path, path + MOJO_SUFFIX)
+    except Exception as e:
+        print(f"No se pudo exportar el MOJO: {e}")
+    print(f"Modelo guardado en cache: {path}")
+    enforce_size_cap(max_bytes, keep=key)
+    return path
+
+def train_cached(estimator, predictors, target, training_frame, validation_frame=None, max_bytes=MODEL_CACHE_MAX_BYTES):
+    """
+    Entrena el estimador salvo que ya exista un modelo con los mismos datos
+    y parámetros; en ese caso lo recarga. Retorna el modelo entrenado.
+    """
+    key = model_key(estimator, training_frame, predictors, target, validation_frame)
+    model = load_cached_model(key)
+    if model is not None:
+        return model
+    estimator.train(x=predictors, y=target, training_frame=training_frame, validation_frame=validation_frame)
+    try:
+        save_cached_model(estimator, key, max_bytes)
+    except Exception as e:
+        print(f"No se pudo guardar el modelo en cache: {e}")
+    return estimator
+
+def remove_model(key):
+    for path in glob.glob(model_path(key) + "*"):
+        os.remove(path)
+
+def enforce_size_cap(max_bytes=MODEL_CACHE_MAX_BYTES, keep=None):
+    """
+    Expulsa los modelos menos usados (binario y MOJO juntos) hasta quedar
+    por debajo del límite. El modelo `keep` (el recién guardado) nunca se expulsa.
+    """
+    entries = {}
+    for path in glob.glob(os.path.join(MODEL_CACHE_DIR, "*")):
+        key = os.path.basename(path).split(".")[0]
+        size, mtime = entries.get(key, (0, 0))
+        entries[key] = (size + os.path.getsize(path), max(mtime, os.path.getmtime(path)))
+    keys = sorted((k for k in entries if k != keep), key=lambda k: entries[k][1])
+    total = sum(size for size, _ in entries.values())
+    while keys and total > max_bytes:
+        oldest = keys.pop(0)
+        total -= entries[oldest][0]
+        remove_model(oldest)
+        print(f"Modelo expulsado por límite de tamaño: {oldest}")
+
+def clear_model_cache():
+    for path in glob.glob(os.path.join(MODEL_CACHE_DIR, "*")):
+        os.remove(path)
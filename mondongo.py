@@ -1,87 +1,278 @@
+import io
 import os
 import csv
 import json
+import time
+import queue
+import hashlib
+import threading
 import requests
-from pymongo import MongoClient
+from pymongo import MongoClient, ReplaceOne
+import instrumentation
 
 MONGO_URI = "mongodb://localhost:27017/"
 DATABASE_NAME = "gtd_database"
 COLLECTION_NAME = "incidents"
 CSV_URL = "https://media.githubusercontent.com/media/moonlightKiR/GTD/refs/heads/main/global_terrorism_data.csv"
 
-def upload_data():
-    base_path = os.path.dirname(os.path.abspath(__file__))
-    csv_file = os.path.join(base_path, "global_terrorism_data.csv")
-    json_file = os.path.join(base_path, "global_terrorism_data.json")
+BATCH_SIZE = 5000
+NUM_WORKERS = 4
 
-    print(f"Descargando CSV desde: {CSV_URL}...")
-    try:
-        response = requests.get(CSV_URL, stream=True)
-        response.raise_for_status()
-        with open(csv_file, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
-        print(f"CSV descargado correctamente.")
-    except Exception as e:
-        print(f"Error descargando el CSV: {e}")
-        return
+KEY_FIELD = "eventid"
+HASH_FIELD = "_row_hash"
+CHECKPOINT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "mongo_checkpoint.json")
+METADATA_COLLECTION = "load_metadata"
+
+def _stream_csv_rows(response):
+    """Parsea el CSV directamente desde la respuesta HTTP, sin escribirlo a disco."""
+    response.raw.decode_content = True
+    response.raw.auto_close = False
+    text_stream = io.TextIOWrapper(response.raw, encoding='latin-1', newline='')
+    return csv.DictReader(text_stream)
+
+def _source_id(headers):
+    """Identificador de la version del CSV publicado (ETag o tamaño)."""
+    return headers.get("ETag") or headers.get("Content-Length") or CSV_URL
 
-    print(f"Transformando CSV a JSON (Streaming)...")
+def get_remote_source_id(timeout=10):
+    """Version del CSV remoto sin descargarlo (peticion HEAD)."""
+    response = requests.head(CSV_URL, allow_redirects=True, timeout=timeout)
+    response.raise_for_status()
+    return _source_id(response.headers)
+
+def row_hash(row):
+    """Hash del contenido de una fila, para detectar si ha cambiado entre cargas."""
+    payload = json.dumps(row, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+
+def load_checkpoint(source_id):
+    """Devuelve cuantas filas se cargaron ya de esta fuente (0 si no hay checkpoint valido)."""
+    if not os.path.exists(CHECKPOINT_FILE):
+        return 0
     try:
-        with open(csv_file, 'r', encoding='latin-1') as f_in, open(json_file, 'w', encoding='utf-8') as f_out:
-            reader = csv.DictReader(f_in)
-            f_out.write("[\n")
-            first = True
-            for row in reader:
-                if not first:
-                    f_out.write(",\n")
-                json.dump(row, f_out, indent=4)
-                first = False
-            f_out.write("\n]")
-        print(f"Archivo JSON creado correctamente.")
-    except Exception as e:
-        print(f"Error en la transformacion: {e}")
-        return
+        with open(CHECKPOINT_FILE, "r", encoding="utf-8") as f:
+            checkpoint = json.load(f)
+    except (OSError, ValueError):
+        return 0
+    if checkpoint.get("source") != source_id:
+        print("Checkpoint de otra version del CSV, se ignora.")
+        return 0
+    return checkpoint.get("rows_done", 0)
+
+def save_checkpoint(source_id, rows_done):
+    directory = os.path.dirname(CHECKPOINT_FILE)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    tmp_file = CHECKPOINT_FILE + ".tmp"
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump({"source": source_id, "rows_done": rows_done}, f)
+    os.replace(tmp_file, CHECKPOINT_FILE)
+
+def clear_checkpoint():
+    if os.path.exists(CHECKPOINT_FILE):
+        os.remove(CHECKPOINT_FILE)
+
+def _insert_batch(collection, docs):
+    collection.insert_many(docs, ordered=False)
+    return {"inserted": len(docs), "updated": 0, "unchanged": 0}
+
+def _upsert_batch(collection, docs):
+    """Upsert por eventid, enviando solo las filas nuevas o con hash distinto."""
+    keys = [doc[KEY_FIELD] for doc in docs]
+    existing = {
+        d[KEY_FIELD]: d.get(HASH_FIELD)
+        for d in collection.find({KEY_FIELD: {"$in": keys}}, {KEY_FIELD: 1, HASH_FIELD: 1, "_id": 0})
+    }
+    operations = [
+        ReplaceOne({KEY_FIELD: doc[KEY_FIELD]}, doc, upsert=True)
+        for doc in docs
+        if existing.get(doc[KEY_FIELD]) != doc[HASH_FIELD]
+    ]
+    result = {"inserted": 0, "updated": 0, "unchanged": len(docs) - len(operations)}
+    if operations:
+        bulk = collection.bulk_write(operations, ordered=False)
+        result["inserted"] = bulk.upserted_count
+        result["updated"] = bulk.modified_count
+    return result
+
+def _insert_worker(collection, batch_queue, write_batch, stats, lock, on_batch_done=None):
+    """Consume lotes de la cola y los escribe en paralelo."""
+    while True:
+        item = batch_queue.get()
+        try:
+            if item is None:
+                return
+            if stats["errors"]:
+                # Ya hubo un fallo: seguimos vaciando la cola para no bloquear al productor
+                continue
+            seq, end_row, batch = item
+            result = write_batch(collection, batch)
+            with lock:
+                for key, value in result.items():
+                    stats[key] += value
+                if on_batch_done:
+                    on_batch_done(seq, end_row)
+        except Exception as e:
+            with lock:
+                stats["errors"].append(e)
+        finally:
+            batch_queue.task_done()
+
+@instrumentation.stage
+def upload_data(batch_size=BATCH_SIZE, num_workers=NUM_WORKERS, incremental=False):
+    """
+    Descarga el CSV del GTD y lo carga en MongoDB en modo pipeline:
+    el parseo alimenta una cola acotada que consumen varios workers
+    de escritura concurrentes. Retorna un resumen con filas/segundo.
 
+    Con incremental=True no se borra la coleccion: se hace upsert por
+    eventid, se saltan las filas cuyo hash no ha cambiado y se guarda
+    un checkpoint para reanudar una carga interrumpida.
+    """
     client = None
+    stats = {"inserted": 0, "updated": 0, "unchanged": 0, "errors": []}
+    lock = threading.Lock()
+    batch_queue = queue.Queue(maxsize=num_workers * 2)
+    workers = []
+    start = time.perf_counter()
+    parsed = 0
+    completed = False
+    source_id = None
+    skip_rows = 0
+
     try:
-        client = MongoClient(MONGO_URI)
+        client = MongoClient(MONGO_URI, maxPoolSize=max(num_workers, 1) + 1)
         db = client[DATABASE_NAME]
         collection = db[COLLECTION_NAME]
-        print(f"Borrando coleccion existente...")
-        collection.drop()
+        if incremental:
+            collection.create_index(KEY_FIELD, unique=True)
+            write_batch = _upsert_batch
+        else:
+            print(f"Borrando coleccion existente...")
+            collection.drop()
+            clear_checkpoint()
+            write_batch = _insert_batch
         print(f"Conectado a MongoDB.")
 
-        print(f"Subiendo registros...")
-        with open(csv_file, 'r', encoding='latin-1') as f_csv:
-            reader = csv.DictReader(f_csv)
+        with requests.get(CSV_URL, stream=True) as response:
+            response.raise_for_status()
+            source_id = _source_id(response.headers)
+
+            on_batch_done = None
+            if incremental:
+                skip_rows = load_checkpoint(source_id)
+                if skip_rows:
+                    print(f"Reanudando desde el checkpoint: {skip_rows} registros ya cargados.")
+                # Los lotes terminan fuera de orden: el checkpoint solo avanza
+                # hasta el ultimo lote contiguo completado.
+                pending = {}
+                progress = {"next_seq": 0}
+
+                def on_batch_done(seq, end_row):
+                    pending[seq] = end_row
+                    rows_done = None
+                    while progress["next_seq"] in pending:
+                        rows_done = pending.pop(progress["next_seq"])
+                        progress["next_seq"] += 1
+                    if rows_done is not None:
+                        save_checkpoint(source_id, rows_done)
+
+            for _ in range(num_workers):
+                worker = threading.Thread(
+                    target=_insert_worker,
+                    args=(collection, batch_queue, write_batch, stats, lock, on_batch_done),
+                    daemon=True,
+                )
+                worker.start()
+                workers.append(worker)
+
+            print(f"Descargando y subiendo CSV desde: {CSV_URL} ({num_workers} workers, lotes de {batch_size})...")
             batch = []
-            count = 0
-            for row in reader:
+            seq = 0
+            for row in _stream_csv_rows(response):
+                parsed += 1
+                if parsed <= skip_rows:
+                    continue
+                row[HASH_FIELD] = row_hash(row)
                 batch.append(row)
-                count += 1
-                if len(batch) >= 5000:
-                    collection.insert_many(batch)
-                    print(f"   - {count} registros subidos...")
+                if len(batch) >= batch_size:
+                    batch_queue.put((seq, parsed, batch))
+                    seq += 1
                     batch = []
-            if batch:
-                collection.insert_many(batch)
-        print(f"Carga completada.")
+                    if stats["errors"]:
+                        break
+                    elapsed = time.perf_counter() - start
+                    written = stats["inserted"] + stats["updated"] + stats["unchanged"]
+                    print(f"   - {parsed} registros leidos, {written} procesados ({written / elapsed:,.0f} filas/s)...")
+            else:
+                if batch:
+                    batch_queue.put((seq, parsed, batch))
+                completed = True
 
     except Exception as e:
         print(f"Error al subir a MongoDB: {e}")
     finally:
+        for _ in workers:
+            batch_queue.put(None)
+        for worker in workers:
+            worker.join()
+        if client and completed and not stats["errors"]:
+            # Una carga reanudada ya escribio datos en el intento anterior
+            changed = stats["inserted"] + stats["updated"] > 0 or skip_rows > 0
+            record_load(client[DATABASE_NAME], source_id, changed)
         if client:
             client.close()
             print("Conexion con MongoDB cerrada.")
-        
-        if os.path.exists(csv_file):
-             os.remove(csv_file)
-        if os.path.exists(json_file):
-             os.remove(json_file)
-        print(f"Archivos temporales eliminados.")
+
+    elapsed = time.perf_counter() - start
+    processed = stats["inserted"] + stats["updated"] + stats["unchanged"]
+    rows_per_sec = processed / elapsed if elapsed > 0 else 0.0
+    if stats["errors"]:
+        print(f"Error al subir a MongoDB: {stats['errors'][0]}")
+    elif completed:
+        if incremental:
+            clear_checkpoint()
+            print(f"Carga incremental completada: {stats['inserted']} nuevos, {stats['updated']} actualizados, "
+                  f"{stats['unchanged']} sin cambios en {elapsed:.2f}s ({rows_per_sec:,.0f} filas/s).")
+        else:
+            print(f"Carga completada: {stats['inserted']} registros en {elapsed:.2f}s ({rows_per_sec:,.0f} filas/s).")
+
+    return {
+        "rows": processed,
+        "inserted": stats["inserted"],
+        "updated": stats["updated"],
+        "unchanged": stats["unchanged"],
+        "seconds": elapsed,
+        "rows_per_sec": rows_per_sec,
+        "errors": len(stats["errors"]),
+    }
+
+def record_load(db, source_id, changed):
+    """Registra la version del CSV cargada; 'version' solo cambia si hubo escrituras."""
+    update = {"$set": {"source": source_id}}
+    if changed:
+        update["$set"]["version"] = time.time()
+    db[METADATA_COLLECTION].update_one({"_id": COLLECTION_NAME}, update, upsert=True)
+
+def get_source_fingerprint():
+    """
+    Huella de los datos cargados en MongoDB, usada como clave de cache.
+    Se basa en la version registrada por upload_data y el numero de
+    documentos; si no hay registro se recurre al dbHash de la coleccion.
+    """
+    client = MongoClient(MONGO_URI)
+    try:
+        db = client[DATABASE_NAME]
+        count = db[COLLECTION_NAME].estimated_document_count()
+        meta = db[METADATA_COLLECTION].find_one({"_id": COLLECTION_NAME})
+        if meta:
+            return f"{meta.get('source')}|{meta.get('version')}|{count}"
+        db_hash = db.command("dbHash", collections=[COLLECTION_NAME])
+        return f"{db_hash['collections'].get(COLLECTION_NAME, '')}|{count}"
+    finally:
+        client.close()
 
 def get_collection():
     client = MongoClient(MONGO_URI)
     db = client[DATABASE_NAME]
-    return db[COLLECTION_NAME]
\ No newline at end of file
+    return db[COLLECTION_NAME]
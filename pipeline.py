@@ -0,0 +1,277 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import polars as pl
+import mondongo
+import eda
+import dbSQL
+import model
+import report
+import instrumentation
+
+PIPELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "pipeline")
+MANIFEST_FILE = os.path.join(PIPELINE_DIR, "manifest.json")
+# dbSQL.DB_FILE es relativo: se resuelve contra el directorio del proyecto, no el de trabajo
+WAREHOUSE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), dbSQL.DB_FILE)
+RAW_FILE = os.path.join(PIPELINE_DIR, "raw.parquet")
+QUALITY_FILE = os.path.join(PIPELINE_DIR, "calidad.parquet")
+CLEAN_FILE = os.path.join(PIPELINE_DIR, "limpio.parquet")
+ANALYTIC_FILE = os.path.join(PIPELINE_DIR, "analitico.parquet")
+ENCODED_FILE = os.path.join(PIPELINE_DIR, "codificado.parquet")
+ENCODER_FILE = os.path.join(PIPELINE_DIR, "encoder.json")
+MODELS_DIR = os.path.join(PIPELINE_DIR, "modelos")
+METRICS_FILE = os.path.join(MODELS_DIR, "metricas.json")
+REPORT_FILE = os.path.join(PIPELINE_DIR, "informe", "informe_gtd.pdf")
+MAX_WORKERS = 2
+
+# Columnas que el notebook descarta antes de codificar y entrenar
+COLUMNS_RETIRE = ["region_txt", "provstate", "city", "latitude", "longitude", "gsubname", "corp1", "target1",
+                  "weapsubtype1_txt"]
+
+def _tmp_parquet(path):
+    return path[:-len(".parquet")] + ".tmp.parquet"
+
+def _write_parquet(df, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = _tmp_parquet(path)
+    df.write_parquet(tmp_path)
+    os.replace(tmp_path, path)
+
+def stage_upload():
+    summary = mondongo.upload_data(incremental=True)
+    if summary["errors"]:
+        raise RuntimeError("La carga en MongoDB ha fallado.")
+
+def stage_extract():
+    df = eda.get_dataframe(use_cache=True)
+    if df is None:
+        raise RuntimeError("No se pudieron extraer los datos de MongoDB.")
+    _write_parquet(df, RAW_FILE)
+
+def stage_quality():
+    report_df, _, _ = eda.profile_data_quality(RAW_FILE, streaming=True)
+    _write_parquet(report_df, QUALITY_FILE)
+
+def stage_clean():
+    tmp_path = _tmp_parquet(CLEAN_FILE)
+    eda.run_streaming_pipeline(RAW_FILE, sink=tmp_path)
+    os.replace(tmp_path, CLEAN_FILE)
+
+def stage_warehouse():
+    tiempos = dbSQL.ejecutar_pipeline_sql(pl.read_parquet(CLEAN_FILE), bulk=True, db_file=WAREHOUSE_FILE)
+    if tiempos is None:
+        raise RuntimeError("No se pudo construir el modelo estrella en SQLite.")
+
+def stage_analytic():
+    tmp_path = _tmp_parquet(ANALYTIC_FILE)
+    dbSQL.exportar_analitico_parquet(tmp_path, WAREHOUSE_FILE)
+    os.replace(tmp_path, ANALYTIC_FILE)
+
+def stage_encode():
+    df = pl.read_parquet(ANALYTIC_FILE)
+    df = df.drop([c for c in COLUMNS_RETIRE if c in df.columns])
+    encoder = eda.CategoricalEncoder().fit(df)
+    df_num, _ = eda.encode_categorical_columns(df, encoder)
+    _write_parquet(df_num, ENCODED_FILE)
+    encoder.save(ENCODER_FILE)
+
+def stage_train():
+    hf = model.init(ENCODED_FILE)
+    predictors, classification_target, regression_target, hf = model.split_data(hf)
+    train, test = model.divide_data(hf)
+    models, timings, metrics = model.train_concurrently(
+        train, test, predictors, classification_target, regression_target
+    )
+    os.makedirs(MODELS_DIR, exist_ok=True)
+    for name, trained in models.items():
+        mojo_path = trained.save_mojo(path=MODELS_DIR, force=True)
+        os.replace(mojo_path, os.path.join(MODELS_DIR, f"{name}.zip"))
+    with open(METRICS_FILE, "w", encoding="utf-8") as f:
+        json.dump({"metricas": metrics, "tiempos": timings}, f, indent=2, default=float)
+
+def stage_charts():
+    with open(METRICS_FILE, "r", encoding="utf-8") as f:
+        metrics = json.load(f)["metricas"]
+    report.generate_report(pl.read_parquet(CLEAN_FILE), REPORT_FILE, quality_report=pl.read_parquet(QUALITY_FILE),
+                           model_metrics=metrics)
+
+# Grafo de etapas: dependencias, salidas que se guardan como checkpoint y,
+# para la carga, la versión del origen remoto y la huella de MongoDB.
+STAGES = {
+    "upload": {"deps": [], "run": stage_upload, "outputs": [],
+               "source": mondongo.get_remote_source_id, "fingerprint": mondongo.get_source_fingerprint},
+    "extract": {"deps": ["upload"], "run": stage_extract, "outputs": [RAW_FILE]},
+    "quality": {"deps": ["extract"], "run": stage_quality, "outputs": [QUALITY_FILE]},
+    "clean": {"deps": ["extract"], "run": stage_clean, "outputs": [CLEAN_FILE]},
+    "warehouse": {"deps": ["clean"], "run": stage_warehouse, "outputs": [WAREHOUSE_FILE]},
+    "analytic": {"deps": ["warehouse"], "run": stage_analytic, "outputs": [ANALYTIC_FILE]},
+    "encode": {"deps": ["analytic"], "run": stage_encode, "outputs": [ENCODED_FILE, ENCODER_FILE]},
+    "train": {"deps": ["encode"], "run": stage_train, "outputs": [MODELS_DIR]},
+    "charts": {"deps": ["clean", "quality", "train"], "run": stage_charts, "outputs": [REPORT_FILE]},
+}
+
+def _hash_path(digest, path):
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                file_path = os.path.join(root, name)
+                digest.update(os.path.relpath(file_path, path).encode("utf-8"))
+                _hash_path(digest, file_path)
+        return
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+
+def output_fingerprint(name):
+    """Huella del contenido de las salidas de una etapa."""
+    stage = STAGES[name]
+    if "fingerprint" in stage:
+        return stage["fingerprint"]()
+    digest = hashlib.blake2b(digest_size=16)
+    for path in stage["outputs"]:
+        _hash_path(digest, path)
+    return digest.hexdigest()
+
+def input_fingerprint(name, upstream, source=None):
+    """Huella de las entradas: huellas de las salidas de las etapas previas y, si aplica, del origen."""
+    payload = json.dumps({"stage": name, "deps": {d: upstream[d] for d in STAGES[name]["deps"]}, "source": source},
+                         sort_keys=True)
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+
+def load_manifest():
+    if not os.path.exists(MANIFEST_FILE):
+        return {}
+    try:
+        with open(MANIFEST_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        print("Manifiesto ilegible, se reconstruye.")
+        return {}
+
+def save_manifest(manifest):
+    os.makedirs(os.path.dirname(MANIFEST_FILE), exist_ok=True)
+    tmp_file = MANIFEST_FILE + ".tmp"
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_file, MANIFEST_FILE)
+
+def required_stages(targets):
+    """Etapas objetivo más todas sus dependencias."""
+    needed = set()
+    pending = list(targets)
+    while pending:
+        name = pending.pop()
+        if name not in STAGES:
+            raise ValueError(f"Etapa desconocida: {name}")
+        if name not in needed:
+            needed.add(name)
+            pending.extend(STAGES[name]["deps"])
+    return needed
+
+def run_stage(name, upstream, manifest, force=False):
+    """
+    Ejecuta una etapa salvo que sus entradas no hayan cambiado y sus
+    salidas sigan en disco. Retorna (huella de salida, estado, segundos).
+    """
+    stage = STAGES[name]
+    source = None
+    if "source" in stage:
+        try:
+            source = stage["source"]()
+        except Exception as e:
+            previous = manifest.get(name)
+            if previous and not force:
+                print(f"[{name}] Origen no disponible ({e}); se reutiliza el último checkpoint.")
+                return previous["output"], "omitida", 0.0
+            raise
+    inputs = input_fingerprint(name, upstream, source)
+    previous = manifest.get(name)
+    outputs_present = all(os.path.exists(path) for path in stage["outputs"])
+    if not force and previous and previous["inputs"] == inputs and outputs_present:
+        print(f"[{name}] Entradas sin cambios, se omite.")
+        return previous["output"], "omitida", 0.0
+
+    print(f"[{name}] Ejecutando...")
+    start = time.perf_counter()
+    stage["run"]()
+    seconds = time.perf_counter() - start
+    output = output_fingerprint(name)
+    manifest[name] = {"inputs": inputs, "output": output, "seconds": seconds,
+                      "finished": time.strftime("%Y-%m-%dT%H:%M:%S")}
+    print(f"[{name}] Completada en {seconds:.1f}s.")
+    return output, "ejecutada", seconds
+
+def run_pipeline(targets=None, force=(), max_workers=MAX_WORKERS):
+    """
+    Ejecuta el grafo de etapas hasta `targets` (por defecto, todas). Cada
+    etapa arranca en cuanto terminan sus dependencias, así que las ramas
+    independientes (gráficos y entrenamiento) corren en paralelo. Las
+    etapas cuyas entradas no cambiaron se omiten reutilizando su checkpoint.
+    `force` lista etapas a re-ejecutar igualmente. Retorna {etapa: estado}.
+    """
+    needed = required_stages(targets or list(STAGES))
+    force = set(force)
+    manifest = load_manifest()
+    lock = threading.Lock()
+    upstream, status = {}, {}
+    running = {}
+    start = time.perf_counter()
+
+    def execute(name):
+        with lock:
+            snapshot = dict(manifest)
+        output, state, seconds = run_stage(name, upstream, snapshot, name in force)
+        with lock:
+            if name in snapshot:
+                manifest[name] = snapshot[name]
+            save_manifest(manifest)
+        return output, state, seconds
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while True:
+            # Orden topológico de STAGES: una cancelación se propaga en la misma pasada
+            for name in [n for n in STAGES if n in needed and n not in status and n not in running.values()]:
+                deps = STAGES[name]["deps"]
+                if any(status.get(d) in ("fallida", "cancelada") for d in deps):
+                    status[name] = "cancelada"
+                    print(f"[{name}] Cancelada: falló una dependencia.")
+                elif all(d in upstream for d in deps):
+                    running[executor.submit(execute, name)] = name
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    upstream[name], status[name], _ = future.result()
+                except Exception as e:
+                    status[name] = "fallida"
+                    print(f"[{name}] Error: {e}")
+
+    print(f"\nPipeline terminado en {time.perf_counter() - start:.1f}s:")
+    for name in STAGES:
+        if name in status:
+            print(f" - {name}: {status[name]}")
+    return status
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ejecuta el pipeline GTD sin notebook, con checkpoints por etapa.")
+    parser.add_argument("targets", nargs="*", help=f"Etapas objetivo (por defecto todas): {', '.join(STAGES)}.")
+    parser.add_argument("--force", nargs="*", default=[], help="Etapas a re-ejecutar aunque no cambien sus entradas.")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS, help="Etapas en paralelo.")
+    parser.add_argument("--trace", help="Activa las trazas de instrumentation y las escribe en este fichero JSON.")
+    args = parser.parse_args(argv)
+
+    if args.trace:
+        instrumentation.configure(trace_file=args.trace)
+    status = run_pipeline(args.targets or None, args.force, args.workers)
+    sys.exit(1 if any(state in ("fallida", "cancelada") for state in status.values()) else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+import os
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import matplotlib
+import matplotlib.pyplot as plt
+import polars as pl
+from fpdf import FPDF
+import eda
+import snapshots
+import instrumentation
+
+REPORT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "reports")
+
+# (nombre, función de eda, argumentos extra)
+CHARTS = [
+    ("top_paises", "plot_top_countries", {"top_n": 15}),
+    ("armas", "plot_attacks_by_weapon", {}),
+    ("evolucion_historica", "plot_historical_evolution", {}),
+    ("top_grupos", "plot_top_groups", {"top_n": 10}),
+]
+
+def _init_worker():
+    # Cada proceso renderiza sin pantalla; plt.show() pasa a ser un no-op
+    matplotlib.use("Agg", force=True)
+    plt.switch_backend("Agg")
+
+def _render_chart(name, func_name, data_path, kwargs, output_dir, fmt):
+    """Renderiza un gráfico de eda en un proceso del pool y lo guarda en disco."""
+    start = time.perf_counter()
+    df = snapshots.read_ipc_mapped(data_path)
+    getattr(eda, func_name)(df, **kwargs)
+    path = os.path.join(output_dir, f"{name}.{fmt}")
+    plt.gcf().savefig(path, dpi=120, bbox_inches="tight")
+    plt.close("all")
+    return name, path, time.perf_counter() - start
+
+def render_charts(charts, output_dir=REPORT_DIR, fmt="png", max_workers=None):
+    """
+    Renderiza en paralelo una lista de tareas (nombre, función, ruta IPC,
+    argumentos) con backend Agg. Retorna {nombre: ruta}; los gráficos que
+    fallan no aparecen en el resultado.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    results = {}
+    # spawn: procesos limpios, sin heredar el backend interactivo del notebook
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=context, initializer=_init_worker) as executor:
+        futures = {
+            name: executor.submit(_render_chart, name, func_name, data_path, kwargs, output_dir, fmt)
+            for name, func_name, data_path, kwargs in charts
+        }
+        for name, future in futures.items():
+            try:
+                _, path, seconds = future.result()
+                results[name] = path
+                print(f" - Gráfico '{name}' renderizado en {seconds:.2f}s.")
+            except Exception as e:
+                print(f"Error renderizando el gráfico '{name}': {e}")
+    return results
+
+def _text(value):
+    # Las fuentes base de FPDF solo cubren latin-1
+    return str(value).encode("latin-1", "replace").decode("latin-1")
+
+def build_pdf(output_pdf, chart_paths, quality_report=None, model_metrics=None, model_charts=None,
+              title="Informe GTD", missing_charts=None):
+    pdf = FPDF()
+    pdf.set_auto_page_break(auto=True, margin=15)
+
+    pdf.add_page()
+    pdf.set_font("Helvetica", "B", 18)
+    pdf.cell(0, 12, _text(title), new_x="LMARGIN", new_y="NEXT")
+    pdf.set_font("Helvetica", size=10)
+    pdf.cell(0, 8, _text(f"Generado: {time.strftime('%Y-%m-%d %H:%M')}"), new_x="LMARGIN", new_y="NEXT")
+
+    if missing_charts:
+        pdf.ln(2)
+        pdf.set_font("Helvetica", "B", 12)
+        pdf.set_text_color(192, 57, 43)
+        pdf.multi_cell(0, 6, _text(f"INFORME INCOMPLETO: no se pudieron generar los gráficos "
+                                   f"{', '.join(missing_charts)}."), new_x="LMARGIN", new_y="NEXT")
+        pdf.set_text_color(0, 0, 0)
+
+    if quality_report is not None and not quality_report.is_empty():
+        pdf.ln(4)
+        pdf.set_font("Helvetica", "B", 13)
+        pdf.cell(0, 10, "Calidad del dato", new_x="LMARGIN", new_y="NEXT")
+        pdf.set_font("Helvetica", size=9)
+        for row in quality_report.head(30).rows(named=True):
+            pdf.cell(0, 5, _text(f"{row['Variable']}: {row['Total_Missing']} faltantes ({row['Percentage']:.2f}%)"),
+                     new_x="LMARGIN", new_y="NEXT")
+
+    if model_metrics:
+        pdf.ln(4)
+        pdf.set_font("Helvetica", "B", 13)
+        pdf.cell(0, 10, "Métricas de los modelos", new_x="LMARGIN", new_y="NEXT")
+        pdf.set_font("Helvetica", size=9)
+        for model_name, metrics in model_metrics.items():
+            resumen = ", ".join(
+                f"{k}: {v:.4f}" if isinstance(v, float) else f"{k}: {v}" for k, v in metrics.items()
+            )
+            pdf.multi_cell(0, 5, _text(f"{model_name} - {resumen}"), new_x="LMARGIN", new_y="NEXT")
+
+    for path in list(chart_paths.values()) + list(model_charts or []):
+        pdf.add_page()
+        pdf.image(path, w=pdf.epw)
+
+    directory = os.path.dirname(output_pdf)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    pdf.output(output_pdf)
+    return output_pdf
+
+@instrumentation.stage
+def generate_report(df, output_pdf=os.path.join(REPORT_DIR, "informe_gtd.pdf"), quality_report=None,
+                    model_metrics=None, model_charts=None, fmt="png", max_workers=None):
+    """
+    Genera el informe nocturno sin notebook: renderiza los gráficos del EDA
+    en un pool de procesos (backend Agg) y los reúne con la calidad del dato
+    y las métricas de los modelos en un único PDF.
+
+    - df: incidentes limpios (o el cubo de eda.build_rollup_cube).
+    - quality_report: DataFrame de eda.profile_data_quality.
+    - model_metrics: {modelo: {métrica: valor}}.
+    - model_charts: rutas de model.plot_model_results(..., output_dir=...).
+
+    Si algún gráfico falla, el PDF se escribe marcado como incompleto y se
+    lanza RuntimeError con los gráficos que faltan.
+    """
+    print("Generando informe headless...")
+    start = time.perf_counter()
+    output_dir = os.path.join(os.path.dirname(output_pdf) or ".", "charts")
+    os.makedirs(output_dir, exist_ok=True)
+
+    # Los procesos leen los datos mapeando un único fichero IPC
+    data_path = os.path.join(output_dir, "_datos.arrow")
+    df.write_ipc(data_path, compression="uncompressed")
+    tasks = [(name, func_name, data_path, kwargs) for name, func_name, kwargs in CHARTS]
+
+    if quality_report is not None:
+        quality_path = os.path.join(output_dir, "_calidad.arrow")
+        missing = quality_report.filter(pl.col("Total_Missing") > 0)
+        missing.write_ipc(quality_path, compression="uncompressed")
+        tasks.insert(0, ("calidad", "save_quality_chart", quality_path, {}))
+    else:
+        missing = None
+
+    try:
+        chart_paths = render_charts(tasks, output_dir, fmt, max_workers)
+    finally:
+        for path in [data_path, os.path.join(output_dir, "_calidad.arrow")]:
+            if os.path.exists(path):
+                os.remove(path)
+
+    failed = [name for name, _, _, _ in tasks if name not in chart_paths]
+    build_pdf(output_pdf, chart_paths, missing, model_metrics, model_charts, missing_charts=failed)
+    if failed:
+        raise RuntimeError(f"Informe incompleto ({output_pdf}): fallaron los gráficos {failed}.")
+    print(f"Informe generado en {time.perf_counter() - start:.2f}s: {output_pdf}")
+    return output_pdf
@@ -0,0 +1,539 @@
+import os
+import json
+import time
+import queue
+import struct
+import zipfile
+import argparse
+import threading
+from concurrent.futures import Future
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import numpy as np
+import polars as pl
+import pyarrow as pa
+import eda
+import snapshots
+
+BATCH_SIZE = 10000
+MAX_BATCH_ROWS = 1024
+MAX_WAIT_MS = 5
+HOST = "127.0.0.1"
+PORT = 8080
+
+# Dirección de los NA en cada split (hex.genmodel.algos.tree.NaSplitDir)
+NSD_NA_VS_REST = 1
+NSD_NA_LEFT = 2
+NSD_LEFT = 4
+
+LOGIT_DISTRIBUTIONS = {"bernoulli", "quasibinomial", "modified_huber"}
+LOG_DISTRIBUTIONS = {"poisson", "gamma", "tweedie"}
+
+def _read_ini(text):
+    """Lee model.ini del MOJO: secciones [info], [columns] y [domains]."""
+    info, columns, domains = {}, [], {}
+    section = None
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith("[") and line.endswith("]"):
+            section = line[1:-1]
+        elif section == "info":
+            key, _, value = line.partition("=")
+            info[key.strip()] = value.strip()
+        elif section == "columns":
+            columns.append(line)
+        elif section == "domains":
+            col_index, _, rest = line.partition(":")
+            _, filename = rest.split()
+            domains[int(col_index)] = filename
+    return info, columns, domains
+
+def _parse_list(value):
+    if not value or value == "null":
+        return None
+    return [float(v) for v in value.strip("[]").split(",")]
+
+class _TreeBuilder:
+    """
+    Aplana los árboles comprimidos del MOJO (formato de SharedTreeMojoModel)
+    en arrays de nodos, para recorrerlos de forma vectorizada con NumPy.
+    """
+
+    def __init__(self):
+        self.col, self.threshold, self.na_vs_rest, self.leftward = [], [], [], []
+        self.left, self.right, self.value = [], [], []
+        self.bs_start, self.bs_offset, self.bs_len = [], [], []
+        self.bits = []
+        self.n_bits = 0
+        self.depth = 0
+
+    def _add(self, col=0, threshold=np.nan, na_dir=0, value=0.0, bitset=None):
+        index = len(self.col)
+        self.col.append(col)
+        self.threshold.append(threshold)
+        self.na_vs_rest.append(na_dir == NSD_NA_VS_REST)
+        self.leftward.append(na_dir in (NSD_NA_LEFT, NSD_LEFT))
+        # Las hojas apuntan a sí mismas: el recorrido se queda quieto al llegar
+        self.left.append(index)
+        self.right.append(index)
+        self.value.append(value)
+        if bitset is None:
+            self.bs_start.append(-1)
+            self.bs_offset.append(0)
+            self.bs_len.append(0)
+        else:
+            offset, nbits, raw = bitset
+            bits = np.unpackbits(np.frombuffer(raw, dtype=np.uint8), bitorder="little")[:nbits]
+            self.bs_start.append(self.n_bits)
+            self.bs_offset.append(offset)
+            self.bs_len.append(nbits)
+            self.bits.append(bits.astype(bool))
+            self.n_bits += nbits
+        return index
+
+    def add_tree(self, buf):
+        root, _ = self._subtree(buf, 0, False, 0)
+        return root
+
+    def _subtree(self, buf, pos, is_leaf, level):
+        self.depth = max(self.depth, level)
+        if is_leaf:
+            return self._add(value=struct.unpack_from("<f", buf, pos)[0]), pos + 4
+        node_type = buf[pos]
+        col = struct.unpack_from("<H", buf, pos + 1)[0]
+        if col == 0xFFFF:
+            # Árbol de un único nodo hoja
+            return self._add(value=struct.unpack_from("<f", buf, pos + 3)[0]), pos + 7
+        na_dir = buf[pos + 3]
+        pos += 4
+        equal = node_type & 12
+        threshold, bitset = np.nan, None
+        if na_dir != NSD_NA_VS_REST:
+            if equal == 0:
+                threshold = struct.unpack_from("<f", buf, pos)[0]
+                pos += 4
+            elif equal == 8:
+                bitset = (0, 32, buf[pos:pos + 4])
+                pos += 4
+            else:
+                offset, nbits = struct.unpack_from("<Hi", buf, pos)
+                pos += 6
+                n_bytes = ((nbits - 1) >> 3) + 1
+                bitset = (offset, nbits, buf[pos:pos + n_bytes])
+                pos += n_bytes
+        index = self._add(col=col, threshold=threshold, na_dir=na_dir, bitset=bitset)
+
+        left_mask = node_type & 51
+        if left_mask & 16:
+            left, pos = self._subtree(buf, pos, True, level + 1)
+        else:
+            size_bytes = left_mask + 1
+            left_size = int.from_bytes(buf[pos:pos + size_bytes], "little")
+            pos += size_bytes
+            left, _ = self._subtree(buf, pos, False, level + 1)
+            pos += left_size
+        right_mask = (node_type & 0xC0) >> 2
+        right, pos = self._subtree(buf, pos, bool(right_mask & 16), level + 1)
+
+        self.left[index] = left
+        self.right[index] = right
+        return index, pos
+
+    def arrays(self):
+        return {
+            "col": np.array(self.col, dtype=np.int64),
+            "threshold": np.array(self.threshold, dtype=np.float64),
+            "na_vs_rest": np.array(self.na_vs_rest, dtype=bool),
+            "leftward": np.array(self.leftward, dtype=bool),
+            "left": np.array(self.left, dtype=np.int64),
+            "right": np.array(self.right, dtype=np.int64),
+            "value": np.array(self.value, dtype=np.float64),
+            "is_bitset": np.array(self.bs_start, dtype=np.int64) >= 0,
+            "bs_start": np.maximum(np.array(self.bs_start, dtype=np.int64), 0),
+            "bs_offset": np.array(self.bs_offset, dtype=np.int64),
+            "bs_len": np.array(self.bs_len, dtype=np.int64),
+            "bits": np.concatenate(self.bits) if self.bits else np.zeros(1, dtype=bool),
+        }
+
+class MojoModel:
+    """
+    Modelo de árboles H2O (drf o gbm) leído directamente del MOJO, sin JVM
+    ni clúster. Puntúa DataFrames de Polars o tablas Arrow por lotes,
+    recorriendo todos los árboles a la vez con NumPy.
+    """
+
+    def __init__(self, path):
+        with zipfile.ZipFile(path) as archive:
+            info, columns, domain_files = _read_ini(archive.read("model.ini").decode("utf-8"))
+            self.algo = info["algo"]
+            if self.algo not in ("drf", "gbm"):
+                raise ValueError(f"Solo se soportan MOJO de árboles (drf, gbm), no '{self.algo}'.")
+            self.columns = columns
+            self.features = columns[:int(info["n_features"])]
+            self.response = columns[-1] if info.get("supervised", "true") == "true" else None
+            self.domains = {
+                columns[i]: archive.read(f"domains/{name}").decode("utf-8").splitlines()
+                for i, name in domain_files.items()
+            }
+
+            self.n_classes = int(info["n_classes"])
+            self.n_trees = int(info["n_trees"])
+            self.n_trees_per_class = int(info["n_trees_per_class"])
+            self.distribution = info.get("distribution", "")
+            self.init_f = float(info.get("init_f", 0) or 0)
+            self.binomial_double_trees = info.get("binomial_double_trees") == "true"
+            self.balance_classes = info.get("balance_classes") == "true"
+            self.default_threshold = float(info.get("default_threshold", 0.5) or 0.5)
+            self.prior_class_distrib = _parse_list(info.get("prior_class_distrib"))
+            self.model_class_distrib = _parse_list(info.get("model_class_distrib"))
+
+            builder = _TreeBuilder()
+            roots, tree_class = [], []
+            names = set(archive.namelist())
+            for class_index in range(self.n_trees_per_class):
+                for tree_index in range(self.n_trees):
+                    name = f"trees/t{class_index:02d}_{tree_index:03d}.bin"
+                    if name in names:  # H2O no exporta los árboles vacíos
+                        roots.append(builder.add_tree(archive.read(name)))
+                        tree_class.append(class_index)
+
+        self._trees = builder.arrays()
+        self._roots = np.array(roots, dtype=np.int64)
+        self._tree_class = np.array(tree_class, dtype=np.int64)
+        self._depth = builder.depth
+        # En las columnas categóricas, un código fuera del dominio del MOJO se
+        # trata como NA, igual que en H2O; las numéricas no tienen dominio
+        self._has_domain = np.array([col in self.domains for col in self.features], dtype=bool)
+        self._domain_len = np.array(
+            [len(self.domains[col]) if col in self.domains else 0 for col in self.features],
+            dtype=np.int64,
+        )
+        self.encoder = eda.CategoricalEncoder(columns=[c for c in self.features if c in self.domains])
+        self.encoder.vocabularies = {c: self.domains[c] for c in self.encoder.columns}
+
+    @property
+    def classes(self):
+        return self.domains.get(self.response) if self.n_classes > 1 else None
+
+    def feature_matrix(self, df, encoder=None):
+        """
+        Matriz float64 de predictores en el orden del MOJO. Con `encoder`
+        (el CategoricalEncoder usado en eda.encode_categorical_columns) se
+        aplica primero esa codificación, para modelos entrenados con ella;
+        las columnas que el MOJO trata como factor se codifican después con
+        su propio dominio. Los niveles no vistos pasan a NA.
+        """
+        if isinstance(df, pa.Table):
+            df = pl.from_arrow(df)
+        if encoder is not None:
+            df = encoder.transform(df)
+        enum_cols = [c for c in self.encoder.columns if c in df.columns]
+        df = self.encoder.transform(df.with_columns([pl.col(c).cast(pl.String) for c in enum_cols]))
+        return df.select([
+            pl.col(c).cast(pl.Float64) if c in df.columns else pl.lit(None, dtype=pl.Float64).alias(c)
+            for c in self.features
+        ]).to_numpy()
+
+    def _score_trees(self, X):
+        """Valor de hoja de cada árbol para cada fila (filas x árboles)."""
+        t = self._trees
+        rows = np.arange(X.shape[0])[:, None]
+        node = np.broadcast_to(self._roots, (X.shape[0], len(self._roots))).copy()
+        for _ in range(self._depth):
+            col = t["col"][node]
+            v = X[rows, col]
+            is_na = np.isnan(v)
+            # El código entero solo se usa en splits por bitset (columnas categóricas);
+            # las numéricas se comparan en float contra el umbral
+            code = np.clip(np.where(is_na, -1, v), -2 ** 31, 2 ** 31 - 1).astype(np.int64)
+
+            is_bitset = t["is_bitset"][node]
+            rel = code - t["bs_offset"][node]
+            in_range = (rel >= 0) & (rel < t["bs_len"][node])
+            in_set = t["bits"][np.where(in_range, t["bs_start"][node] + rel, 0)]
+            with np.errstate(invalid="ignore"):
+                goes_right = np.where(is_bitset, in_set, v >= t["threshold"][node])
+            goes_right &= ~t["na_vs_rest"][node]
+
+            out_of_domain = self._has_domain[col] & (code >= self._domain_len[col])
+            na_path = is_na | (is_bitset & ~in_range) | out_of_domain
+            goes_right = np.where(na_path, ~t["leftward"][node], goes_right)
+            node = np.where(goes_right, t["right"][node], t["left"][node])
+        return t["value"][node]
+
+    def predict_raw(self, X):
+        """Predicciones al estilo de H2O: columna 0 la etiqueta, 1.. las probabilidades."""
+        leaves = self._score_trees(X)
+        n = X.shape[0]
+        preds = np.zeros((n, self.n_classes + 1 if self.n_classes > 1 else 1))
+        offset = 0 if self.n_classes == 1 else 1
+        for class_index in range(self.n_trees_per_class):
+            preds[:, offset + class_index] = leaves[:, self._tree_class == class_index].sum(axis=1)
+        if self.algo == "gbm":
+            return self._unify_gbm(preds)
+        return self._unify_drf(preds)
+
+    def _unify_drf(self, preds):
+        if self.n_classes == 1:
+            preds[:, 0] /= self.n_trees
+            return preds
+        if self.n_classes == 2 and not self.binomial_double_trees:
+            preds[:, 1] /= self.n_trees
+            preds[:, 2] = 1.0 - preds[:, 1]
+        else:
+            total = preds[:, 1:].sum(axis=1, keepdims=True)
+            preds[:, 1:] = np.divide(preds[:, 1:], total, out=preds[:, 1:], where=total > 0)
+        return self._finish_classification(preds)
+
+    def _unify_gbm(self, preds):
+        if self.distribution in LOGIT_DISTRIBUTIONS:
+            preds[:, 2] = 1.0 / (1.0 + np.exp(-(preds[:, 1] + self.init_f)))
+            preds[:, 1] = 1.0 - preds[:, 2]
+        elif self.distribution == "multinomial":
+            if self.n_classes == 2:
+                preds[:, 1] += self.init_f
+                preds[:, 2] = -preds[:, 1]
+            scores = preds[:, 1:] - preds[:, 1:].max(axis=1, keepdims=True)
+            scores = np.exp(scores)
+            preds[:, 1:] = scores / scores.sum(axis=1, keepdims=True)
+        else:
+            f = preds[:, 0] + self.init_f
+            preds[:, 0] = np.exp(f) if self.distribution in LOG_DISTRIBUTIONS else f
+            return preds
+        return self._finish_classification(preds)
+
+    def _finish_classification(self, preds):
+        if self.balance_classes and self.prior_class_distrib and self.model_class_distrib:
+            prior = np.array(self.prior_class_distrib)
+            sampled = np.array(self.model_class_distrib)
+            factor = np.divide(prior, sampled, out=np.ones_like(prior), where=(prior != 0) & (sampled != 0))
+            preds[:, 1:] *= factor
+            total = preds[:, 1:].sum(axis=1, keepdims=True)
+            preds[:, 1:] = np.divide(preds[:, 1:], total, out=preds[:, 1:], where=total > 0)
+        if self.n_classes == 2:
+            preds[:, 0] = preds[:, 2] >= self.default_threshold
+        else:
+            preds[:, 0] = preds[:, 1:].argmax(axis=1)
+        return preds
+
+    def predict(self, df, encoder=None):
+        """Puntúa un DataFrame de Polars o una tabla Arrow; retorna un DataFrame de Polars."""
+        preds = self.predict_raw(self.feature_matrix(df, encoder))
+        if self.n_classes == 1:
+            return pl.DataFrame({"predict": preds[:, 0]})
+        classes = self.classes
+        labels = pl.Series("predict", classes, dtype=pl.String).gather(preds[:, 0].astype(np.int64))
+        return pl.DataFrame(
+            [labels] + [pl.Series(level, preds[:, i + 1]) for i, level in enumerate(classes)]
+        )
+
+def load_mojo(path):
+    """Carga un MOJO exportado (por ejemplo, los '.mojo.zip' de model_cache)."""
+    start = time.perf_counter()
+    model = MojoModel(path)
+    print(f"MOJO '{model.algo}' cargado en {time.perf_counter() - start:.2f}s: "
+          f"{len(model._roots)} árboles, {len(model.features)} predictores.")
+    return model
+
+def latency_report(latencies, rows, seconds):
+    """p50/p99 de latencia (ms) y filas por segundo."""
+    latencies = np.asarray(latencies, dtype=np.float64) * 1000
+    return {
+        "requests": int(latencies.size),
+        "rows": int(rows),
+        "p50_ms": float(np.percentile(latencies, 50)) if latencies.size else 0.0,
+        "p99_ms": float(np.percentile(latencies, 99)) if latencies.size else 0.0,
+        "rows_per_sec": rows / seconds if seconds > 0 else 0.0,
+    }
+
+def score_batches(model, df, batch_size=BATCH_SIZE, encoder=None):
+    """
+    Puntúa un DataFrame de Polars o una tabla Arrow en lotes de batch_size
+    filas. Retorna (predicciones, informe de latencia por lote).
+    """
+    if isinstance(df, pa.Table):
+        df = pl.from_arrow(df)
+    start = time.perf_counter()
+    latencies, results = [], []
+    for batch in df.iter_slices(batch_size):
+        batch_start = time.perf_counter()
+        results.append(model.predict(batch, encoder))
+        latencies.append(time.perf_counter() - batch_start)
+    seconds = time.perf_counter() - start
+    report = latency_report(latencies, df.height, seconds)
+    print(f"Puntuadas {df.height} filas en {seconds:.2f}s ({report['rows_per_sec']:,.0f} filas/s, "
+          f"p50 {report['p50_ms']:.1f} ms, p99 {report['p99_ms']:.1f} ms por lote).")
+    predictions = pl.concat(results) if results else model.predict(df.clear(), encoder)
+    return predictions, report
+
+class MicroBatcher:
+    """
+    Agrupa las peticiones concurrentes en micro-lotes: espera como mucho
+    max_wait_ms o hasta reunir max_batch_rows filas, puntúa el lote de una
+    vez y reparte el resultado a cada petición.
+    """
+
+    def __init__(self, model, max_batch_rows=MAX_BATCH_ROWS, max_wait_ms=MAX_WAIT_MS, encoder=None):
+        self.model = model
+        self.max_batch_rows = max_batch_rows
+        self.max_wait = max_wait_ms / 1000
+        self.encoder = encoder
+        self.requests = queue.Queue()
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.rows = 0
+        self.started = time.perf_counter()
+        self.worker = threading.Thread(target=self._loop, daemon=True)
+        self.worker.start()
+
+    def submit(self, df):
+        future = Future()
+        self.requests.put((df, future, time.perf_counter()))
+        return future
+
+    def predict(self, df):
+        return self.submit(df).result()
+
+    def _loop(self):
+        while True:
+            item = self.requests.get()
+            if item is None:
+                return
+            pending = [item]
+            n_rows = item[0].height
+            deadline = time.perf_counter() + self.max_wait
+            while n_rows < self.max_batch_rows:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self.requests.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    self.requests.put(None)
+                    break
+                pending.append(item)
+                n_rows += item[0].height
+            self._score(pending)
+
+    def _score(self, pending):
+        try:
+            batch = pl.concat([df for df, _, _ in pending], how="diagonal_relaxed")
+            predictions = self.model.predict(batch, self.encoder)
+        except Exception as e:
+            for _, future, _ in pending:
+                future.set_exception(e)
+            return
+        offset = 0
+        now = time.perf_counter()
+        with self.lock:
+            for df, future, submitted in pending:
+                future.set_result(predictions.slice(offset, df.height))
+                offset += df.height
+                self.latencies.append(now - submitted)
+            self.rows += offset
+
+    def stats(self):
+        with self.lock:
+            return latency_report(self.latencies, self.rows, time.perf_counter() - self.started)
+
+    def close(self):
+        self.requests.put(None)
+        self.worker.join()
+
+def _make_handler(batcher):
+    class ScoringHandler(BaseHTTPRequestHandler):
+        def _send(self, status, payload):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/stats":
+                self._send(200, batcher.stats())
+            else:
+                self._send(404, {"error": "ruta no encontrada"})
+
+        def do_POST(self):
+            if self.path != "/predict":
+                self._send(404, {"error": "ruta no encontrada"})
+                return
+            try:
+                payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                records = payload["rows"] if isinstance(payload, dict) else payload
+                df = pl.DataFrame(records, infer_schema_length=None)
+                predictions = batcher.predict(df)
+                self._send(200, {"predictions": predictions.to_dicts()})
+            except Exception as e:
+                self._send(400, {"error": str(e)})
+
+        def log_message(self, format, *args):
+            pass
+
+    return ScoringHandler
+
+def serve(model, host=HOST, port=PORT, max_batch_rows=MAX_BATCH_ROWS, max_wait_ms=MAX_WAIT_MS, encoder=None):
+    """
+    Endpoint HTTP local: POST /predict con una lista de registros JSON (o
+    {"rows": [...]}) y GET /stats con p50/p99 y filas por segundo.
+    """
+    batcher = MicroBatcher(model, max_batch_rows, max_wait_ms, encoder)
+    server = ThreadingHTTPServer((host, port), _make_handler(batcher))
+    print(f"Sirviendo predicciones en http://{host}:{port}/predict (micro-lotes de {max_batch_rows} filas, "
+          f"espera máxima {max_wait_ms} ms)...")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batcher.close()
+        print(f"Servidor detenido. {batcher.stats()}")
+
+def read_frame(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".parquet":
+        return pl.read_parquet(path)
+    if extension in (".arrow", ".ipc", ".feather"):
+        return snapshots.read_ipc_mapped(path)
+    if extension == ".csv":
+        return pl.read_csv(path, infer_schema_length=None)
+    raise ValueError(f"Formato de entrada no soportado: {extension}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Puntuación de modelos MOJO sin clúster H2O.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    score_parser = subparsers.add_parser("score", help="Puntúa un fichero Parquet/IPC/CSV por lotes.")
+    score_parser.add_argument("mojo")
+    score_parser.add_argument("input")
+    score_parser.add_argument("output", help="Fichero Parquet de salida.")
+    score_parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    score_parser.add_argument("--encoder", help="JSON de CategoricalEncoder.save usado al entrenar.")
+
+    serve_parser = subparsers.add_parser("serve", help="Endpoint HTTP local con micro-lotes.")
+    serve_parser.add_argument("mojo")
+    serve_parser.add_argument("--host", default=HOST)
+    serve_parser.add_argument("--port", type=int, default=PORT)
+    serve_parser.add_argument("--max-batch-rows", type=int, default=MAX_BATCH_ROWS)
+    serve_parser.add_argument("--max-wait-ms", type=float, default=MAX_WAIT_MS)
+    serve_parser.add_argument("--encoder", help="JSON de CategoricalEncoder.save usado al entrenar.")
+
+    args = parser.parse_args(argv)
+    model = load_mojo(args.mojo)
+    encoder = eda.CategoricalEncoder.load(args.encoder) if args.encoder else None
+
+    if args.command == "score":
+        predictions, report = score_batches(model, read_frame(args.input), args.batch_size, encoder)
+        predictions.write_parquet(args.output)
+        print(json.dumps(report))
+    else:
+        serve(model, args.host, args.port, args.max_batch_rows, args.max_wait_ms, encoder)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+import os
+import glob
+import hashlib
+import polars as pl
+import pyarrow as pa
+
+SNAPSHOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "snapshots")
+SNAPSHOT_MAX_BYTES = 2 * 1024 ** 3
+SNAPSHOT_FORMAT = "ipc"
+
+def snapshot_key(name, fingerprint, params=None):
+    """Clave de la snapshot: nombre legible + hash de la huella de la fuente y los parametros."""
+    payload = f"{fingerprint}|{sorted((params or {}).items())}"
+    digest = hashlib.blake2b(payload.encode("utf-8"), digest_size=12).hexdigest()
+    return f"{name}-{digest}"
+
+def snapshot_path(key, fmt=SNAPSHOT_FORMAT):
+    extension = "arrow" if fmt == "ipc" else "parquet"
+    return os.path.join(SNAPSHOT_DIR, f"{key}.{extension}")
+
+def read_ipc_mapped(path):
+    """
+    Lee un fichero Arrow IPC mapeándolo en memoria con pyarrow (sin copiar
+    los buffers si no están comprimidos). pl.read_ipc ya no admite memory_map.
+    """
+    with pa.memory_map(path, "r") as source:
+        table = pa.ipc.open_file(source).read_all()
+    return pl.from_arrow(table)
+
+def load_snapshot(key, fmt=SNAPSHOT_FORMAT):
+    """
+    Carga la snapshot si existe. El formato IPC se mapea en memoria,
+    por lo que la carga es practicamente instantanea. Solo se borra el
+    fichero si no se puede decodificar.
+    """
+    path = snapshot_path(key, fmt)
+    if not os.path.exists(path):
+        return None
+    try:
+        if fmt == "ipc":
+            df = read_ipc_mapped(path)
+        else:
+            df = pl.read_parquet(path)
+    except (pa.ArrowException, pl.exceptions.PolarsError) as e:
+        print(f"Snapshot corrupta, se descarta: {e}")
+        os.remove(path)
+        return None
+    # Actualizamos mtime para que la expulsion sea LRU
+    os.utime(path)
+    print(f"Snapshot cargada desde cache: {path} ({df.height} filas).")
+    return df
+
+def save_snapshot(df, key, fmt=SNAPSHOT_FORMAT, max_bytes=SNAPSHOT_MAX_BYTES):
+    """Guarda el DataFrame como snapshot columnar e invalida las versiones anteriores."""
+    if not os.path.exists(SNAPSHOT_DIR):
+        os.makedirs(SNAPSHOT_DIR)
+    path = snapshot_path(key, fmt)
+    tmp_path = path + ".tmp"
+    if fmt == "ipc":
+        # Sin compresion para poder mapear el fichero en memoria
+        df.write_ipc(tmp_path, compression="uncompressed")
+    else:
+        df.write_parquet(tmp_path)
+    os.replace(tmp_path, path)
+    print(f"Snapshot guardada: {path}")
+
+    invalidate_snapshots(key.rsplit("-", 1)[0], keep=path)
+    enforce_size_cap(max_bytes, keep=path)
+    return path
+
+def invalidate_snapshots(name, keep=None):
+    """Elimina las snapshots de un mismo nombre con otra huella (fuente obsoleta)."""
+    for path in glob.glob(os.path.join(SNAPSHOT_DIR, f"{name}-*")):
+        if path != keep:
+            os.remove(path)
+            print(f"Snapshot obsoleta eliminada: {path}")
+
+def enforce_size_cap(max_bytes=SNAPSHOT_MAX_BYTES, keep=None):
+    """
+    Expulsa las snapshots menos usadas hasta quedar por debajo del limite.
+    La snapshot `keep` (la recien escrita) nunca se expulsa, aunque por si
+    sola supere el limite.
+    """
+    files = [f for f in glob.glob(os.path.join(SNAPSHOT_DIR, "*")) if not f.endswith(".tmp")]
+    total = sum(os.path.getsize(f) for f in files)
+    files = [f for f in files if f != keep]
+    files.sort(key=os.path.getmtime)
+    while files and total > max_bytes:
+        oldest = files.pop(0)
+        total -= os.path.getsize(oldest)
+        os.remove(oldest)
+        print(f"Snapshot expulsada por limite de tamaño: {oldest}")
+
+def clear_snapshots():
+    for path in glob.glob(os.path.join(SNAPSHOT_DIR, "*")):
+        os.remove(path)
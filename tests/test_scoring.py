@@ -0,0 +1,104 @@
+import shutil
+import struct
+import zipfile
+import numpy as np
+import polars as pl
+import pytest
+import scoring
+
+def _write_single_split_mojo(path, threshold, left_value, right_value):
+    """MOJO drf de regresión con un único split numérico sobre 'x' (NA a la derecha)."""
+    ini = "\n".join([
+        "[info]",
+        "algo = drf",
+        "n_features = 1",
+        "n_classes = 1",
+        "n_trees = 1",
+        "n_trees_per_class = 1",
+        "supervised = true",
+        "",
+        "[columns]",
+        "x",
+        "y",
+        "",
+        "[domains]",
+        "",
+    ])
+    # node_type 80: hijo izquierdo y derecho son hojas, split numérico (equal == 0)
+    na_right = 3
+    tree = struct.pack("<BHBf", 80, 0, na_right, threshold) + struct.pack("<ff", left_value, right_value)
+    with zipfile.ZipFile(path, "w") as archive:
+        archive.writestr("model.ini", ini)
+        archive.writestr("trees/t00_000.bin", tree)
+
+def test_numeric_split_above_int32_range(tmp_path):
+    path = tmp_path / "split.mojo.zip"
+    _write_single_split_mojo(path, 1e10, 1.0, 2.0)
+    model = scoring.MojoModel(str(path))
+
+    df = pl.DataFrame({"x": [3e9, 2e10, 5.0, None]})
+    preds = model.predict(df)["predict"].to_list()
+
+    assert preds == [1.0, 2.0, 1.0, 2.0]
+
+@pytest.mark.parametrize("extension", [".arrow", ".ipc"])
+def test_score_cli_reads_arrow_input(tmp_path, extension):
+    mojo_path = tmp_path / "split.mojo.zip"
+    _write_single_split_mojo(mojo_path, 1e10, 1.0, 2.0)
+    input_path = tmp_path / f"entrada{extension}"
+    pl.DataFrame({"x": [3e9, 2e10, None]}).write_ipc(input_path, compression="uncompressed")
+    output_path = tmp_path / "salida.parquet"
+
+    scoring.main(["score", str(mojo_path), str(input_path), str(output_path)])
+
+    assert pl.read_parquet(output_path)["predict"].to_list() == [1.0, 2.0, 2.0]
+
+def _h2o_session():
+    h2o = pytest.importorskip("h2o")
+    if shutil.which("java") is None:
+        pytest.skip("H2O necesita una JVM")
+    h2o.init(nthreads=2)
+    return h2o
+
+def _training_frame(n=2000, seed=42):
+    rng = np.random.default_rng(seed)
+    region = rng.choice(["Europa", "Asia", "Africa", "America"], size=n)
+    eventid = rng.integers(197000000000, 202000000000, size=n).astype(np.float64)
+    nkill = rng.poisson(2, size=n).astype(np.float64)
+    nkill[rng.random(n) < 0.05] = np.nan
+    success = np.where((nkill > 1) | (region == "Asia"), "1", "0")
+    return pl.DataFrame({
+        "region": region,
+        "eventid": eventid,
+        "nkill": nkill,
+        "success": success,
+        "nwound": nkill * 1.5 + rng.normal(size=n),
+    })
+
+@pytest.mark.parametrize("algo, target", [
+    ("drf", "success"),
+    ("drf", "nwound"),
+    ("gbm", "success"),
+    ("gbm", "nwound"),
+])
+def test_matches_h2o_predictions(tmp_path, algo, target):
+    h2o = _h2o_session()
+    from h2o.estimators import H2OGradientBoostingEstimator, H2ORandomForestEstimator
+
+    df = _training_frame()
+    predictors = ["region", "eventid", "nkill"]
+    frame = h2o.H2OFrame(df.to_pandas(), column_types={"region": "enum", "success": "enum"})
+    estimator_class = H2ORandomForestEstimator if algo == "drf" else H2OGradientBoostingEstimator
+    estimator = estimator_class(ntrees=10, max_depth=5, seed=1)
+    estimator.train(x=predictors, y=target, training_frame=frame)
+    mojo_path = estimator.download_mojo(path=str(tmp_path))
+
+    expected = estimator.predict(frame[predictors]).as_data_frame(use_pandas=True)
+    got = scoring.MojoModel(mojo_path).predict(df.select(predictors))
+
+    if target == "success":
+        assert got["predict"].to_list() == expected["predict"].astype(str).tolist()
+        for level in ("0", "1"):
+            np.testing.assert_allclose(got[level].to_numpy(), expected["p" + level].to_numpy(), rtol=1e-5, atol=1e-6)
+    else:
+        np.testing.assert_allclose(got["predict"].to_numpy(), expected["predict"].to_numpy(), rtol=1e-5, atol=1e-6)
@@ -1,11 +1,46 @@
+import psutil
 import polars as pl
 import pandas as pd
+import instrumentation
 
-def convert_to_pandas(df):
+CONVERSION_MODES = ("numpy", "arrow")
+
+def _mb(n_bytes):
+    return n_bytes / 1024 ** 2
+
+def _rss():
+    return psutil.Process().memory_info().rss
+
+@instrumentation.stage
+def convert_to_pandas(df, mode="numpy", columns=None):
+    """
+    Convierte un DataFrame de Polars a pandas.
+    - mode="numpy": dtypes clásicos de NumPy (copia todas las columnas).
+    - mode="arrow": dtypes pd.ArrowDtype respaldados por los buffers de
+      Arrow, sin copia cuando es posible y sin columnas object para texto.
+    - columns: convierte solo ese subconjunto de columnas.
+    Informa del tamaño en Polars y de cuánto crece el RSS del proceso al
+    convertir, que es la memoria realmente copiada (memory_usage de pandas
+    mide igual los buffers compartidos y los copiados).
+    """
+    if mode not in CONVERSION_MODES:
+        raise ValueError(f"Modo de conversión no soportado: '{mode}' (usa uno de {CONVERSION_MODES}).")
     print("Iniciando conversión de Polars a Pandas...")
     try:
-        df_pandas = df.to_pandas()
+        if columns is not None:
+            df = df.select(columns)
+        size_before = df.estimated_size()
+        rss_before = _rss()
+
+        if mode == "arrow":
+            df_pandas = df.to_pandas(use_pyarrow_extension_array=True)
+        else:
+            df_pandas = df.to_pandas()
+
+        copied = _rss() - rss_before
         print(f"Conversión exitosa. DataFrame de Pandas listo con {df_pandas.shape[0]} registros.")
+        print(f"Memoria: Polars {_mb(size_before):.1f} MB; la conversión añade {_mb(copied):+.1f} MB "
+              f"al proceso (modo '{mode}').")
         return df_pandas
     except Exception as e:
         print(f"Error crítico durante la conversión a Pandas: {e}")